@@ -25,12 +25,28 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client
 
 from plugins import glovar
-from plugins.functions.timers import backup_files, clean_banned, clean_members, interval_hour_01, interval_min_10
+from plugins.functions.file import init_shards, save_flush
+from plugins.functions.regex import compile_ad, compile_words, save_count
+from plugins.functions.store import init_store
+from plugins.functions.timers import backup_files, clean_banned, clean_members, interval_hour_01, interval_min_01
+from plugins.functions.timers import interval_min_10
 from plugins.functions.timers import reset_data, send_count, update_admins, update_status
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Open the optional store
+init_store()
+
+# Load the groups' data on first use
+init_shards()
+
+# Compile regex patterns
+for word_type in glovar.regex:
+    compile_words(word_type)
+
+compile_ad()
+
 # Config session
 app = Client(
     session_name="bot",
@@ -44,6 +60,7 @@ update_status(app, "online")
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
 scheduler.add_job(interval_hour_01, "interval", [app], hours=1)
+scheduler.add_job(interval_min_01, "interval", [app], minutes=1)
 scheduler.add_job(interval_min_10, "interval", minutes=10)
 scheduler.add_job(update_status, "cron", [app, "awake"], minute=30)
 scheduler.add_job(clean_members, "cron", [app], hour=2)
@@ -59,3 +76,9 @@ app.idle()
 
 # Stop
 app.stop()
+
+# Save regex hit counts
+save_count()
+
+# Write the pending data files
+save_flush()
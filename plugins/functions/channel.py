@@ -18,7 +18,7 @@
 
 import logging
 from json import dumps
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from pyrogram import Chat, Client, Message
 from pyrogram.errors import FloodWait
@@ -26,7 +26,7 @@ from pyrogram.errors import FloodWait
 from .. import glovar
 from .etc import code, code_block, general_link, get_forward_name, get_full_name, get_md5sum, get_text, lang
 from .etc import message_link, thread, wait_flood
-from .file import crypt_file, data_to_file, delete_file, get_new_path, save
+from .file import crypt_file, data_to_file, delete_file, get_new_path, save_user
 from .image import get_file_id
 from .telegram import get_group_info, send_document, send_message
 
@@ -392,16 +392,39 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
     return False
 
 
-def share_regex_count(client: Client, word_type: str) -> bool:
+def share_regex_cost(client: Client, word_type: str, costs: Dict[str, float]) -> bool:
+    # Use this function to share the cost report of the received regex words to REGEX
+    try:
+        if not costs:
+            return True
+
+        file = data_to_file(costs)
+        share_data(
+            client=client,
+            receivers=["REGEX"],
+            action="regex",
+            action_type="cost",
+            data=f"{word_type}_words",
+            file=file
+        )
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share regex cost error: {e}", exc_info=True)
+
+    return False
+
+
+def share_regex_count(client: Client, word_type: str, words: Dict[str, int]) -> bool:
     # Use this function to share regex count to REGEX
     try:
         if not glovar.regex.get(word_type):
             return True
 
-        if not eval(f"glovar.{word_type}_words"):
+        if not words:
             return True
 
-        file = data_to_file(eval(f"glovar.{word_type}_words"))
+        file = data_to_file(words)
         share_data(
             client=client,
             receivers=["REGEX"],
@@ -445,8 +468,7 @@ def update_score(client: Client, uid: int) -> bool:
     try:
         count = len(glovar.user_ids[uid]["detected"])
         score = count * 0.6
-        glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
-        save("user_ids")
+        save_user(["score", uid, glovar.sender.lower(), score])
         share_data(
             client=client,
             receivers=glovar.receivers["score"],
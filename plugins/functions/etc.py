@@ -19,17 +19,18 @@
 import logging
 import re
 from hashlib import md5
+from functools import lru_cache
 from html import escape
 from json import dumps
 from random import choice, uniform
 from string import ascii_letters, digits
 from threading import Thread, Timer
 from time import sleep, time
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
-from opencc import convert
+from opencc import OpenCC
 from pyrogram import InlineKeyboardMarkup, Message, MessageEntity, User
 from pyrogram.errors import FloodWait
 
@@ -91,6 +92,27 @@ def code_block(text: Any) -> str:
     return ""
 
 
+def convert_t2s(text: str) -> str:
+    # Convert traditional Chinese to simplified Chinese
+    result = text
+    try:
+        # Short texts such as names and filenames repeat a lot
+        if len(text) <= 64:
+            return convert_t2s_short(text)
+
+        result = get_converter().convert(text)
+    except Exception as e:
+        logger.warning(f"Convert t2s error: {e}", exc_info=True)
+
+    return result
+
+
+@lru_cache(maxsize=4096)
+def convert_t2s_short(text: str) -> str:
+    # Convert a short text from traditional Chinese to simplified Chinese, the results are cached
+    return get_converter().convert(text)
+
+
 def crypt_str(operation: str, text: str, key: str) -> str:
     # Encrypt or decrypt a string
     result = ""
@@ -195,6 +217,96 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_converter() -> OpenCC:
+    # Get the thread's own long-lived t2s converter
+    result = getattr(glovar.converter, "t2s", None)
+
+    if result is None:
+        result = OpenCC("t2s.json")
+        glovar.converter.t2s = result
+
+    return result
+
+
+def get_emojis(text: str) -> Dict[str, int]:
+    # Get the unprotected emojis in the text with their counts, the longest emoji wins at each position
+    result = {}
+    try:
+        if not text:
+            return {}
+
+        # Pure ASCII text has no emoji
+        if len(text.encode("utf-8", "surrogatepass")) == len(text):
+            return {}
+
+        trie = glovar.emoji_trie
+
+        if not trie.keys() & set(text):
+            return {}
+
+        length = len(text)
+        end = 0
+
+        for i in [i for i, c in enumerate(text) if c in trie]:
+            if i < end:
+                continue
+
+            # None means no emoji ends here, "" means a protected emoji
+            node = trie[text[i]]
+            emoji = node.get("")
+            j = i + 1
+            end = j
+
+            while j < length:
+                node = node.get(text[j])
+
+                if node is None:
+                    break
+
+                j += 1
+
+                if "" in node:
+                    emoji = node[""]
+                    end = j
+
+            if emoji is None:
+                end = i + 1
+                continue
+
+            if not emoji:
+                continue
+
+            result[emoji] = result.get(emoji, 0) + 1
+    except Exception as e:
+        logger.warning(f"Get emojis error: {e}", exc_info=True)
+
+    return result
+
+
+def get_entities(message: Message) -> List[Tuple[str, str, MessageEntity]]:
+    # Get a message's entities with their texts, the text is only encoded once
+    result = []
+    try:
+        entities = message.entities or message.caption_entities
+
+        if not entities:
+            return []
+
+        text = (message.text or message.caption or "").encode("utf-16-le")
+
+        for en in entities:
+            if en.type in {"url", "mention"}:
+                en_text = text[en.offset * 2:(en.offset + en.length) * 2].decode("utf-16-le")
+            else:
+                en_text = en.url or ""
+
+            result.append((en.type, en_text, en))
+    except Exception as e:
+        logger.warning(f"Get entities error: {e}", exc_info=True)
+
+    return result
+
+
 def get_entity_text(message: Message, entity: MessageEntity) -> str:
     # Get a message's entity text
     result = ""
@@ -284,21 +396,16 @@ def get_int(text: str) -> Optional[int]:
     return result
 
 
-def get_links(message: Message) -> List[str]:
+def get_links(message: Message, entities: List[Tuple[str, str, MessageEntity]] = None) -> List[str]:
     # Get a message's links
     result = []
     try:
-        entities = message.entities or message.caption_entities
-        if entities:
-            for en in entities:
-                if en.type == "url":
-                    link = get_entity_text(message, en)
-                elif en.url:
-                    link = en.url
-                else:
-                    continue
+        if entities is None:
+            entities = get_entities(message)
 
-                link = get_stripped_link(link)
+        for en_type, en_text, en in entities:
+            if en_type == "url" or en.url:
+                link = get_stripped_link(en_text)
 
                 if not link:
                     continue
@@ -548,16 +655,23 @@ def t2t(text: str, normal: bool, printable: bool) -> str:
             return ""
 
         if normal:
-            for special in ["spc", "spe"]:
-                text = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in text)
+            text = text.translate(glovar.special_table)
 
+        # Pure ASCII text is never changed by NFKC or OpenCC, and only its control characters are not printable
+        if len(text.encode("utf-8", "surrogatepass")) == len(text):
+            if printable:
+                text = text.translate(glovar.control_table)
+
+            return text
+
+        if normal:
             text = normalize("NFKC", text)
 
         if printable:
             text = "".join(t for t in text if t.isprintable() or t in {"\n", "\r", "\t"})
 
         if normal and glovar.zh_cn:
-            text = convert(text, config="t2s.json")
+            text = convert_t2s(text)
     except Exception as e:
         logger.warning(f"T2T error: {e}", exc_info=True)
 
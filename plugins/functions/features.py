@@ -0,0 +1,148 @@
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from typing import Any, Callable, Iterable, List, Tuple
+
+from pyrogram import Message, MessageEntity
+
+from .. import glovar
+from .channel import get_content
+from .etc import get_entities, get_filename, get_forward_name, get_full_name, get_links, get_text
+from .image import get_file_id
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class MessageFeatures:
+    # The features of a message, each of them is computed at most once
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.memo = {}
+
+    def get(self, key: tuple, func: Callable, *args) -> Any:
+        # Get the memoized feature, compute it on first use
+        if key not in self.memo:
+            self.memo[key] = func(*args)
+
+        return self.memo[key]
+
+    def content(self) -> str:
+        # The content key of the message
+        return self.get(("content",), get_content, self.message)
+
+    def entities(self) -> List[Tuple[str, str, MessageEntity]]:
+        # The entities' types, texts and objects
+        return self.get(("entities",), get_entities, self.message)
+
+    def file_id(self) -> Tuple[str, str, bool]:
+        # The image file id, file reference and whether the image is big enough
+        return self.get(("file_id",), get_file_id, self.message)
+
+    def filename(self, normal: bool = False, printable: bool = False) -> str:
+        # The document's or the audio's filename
+        return self.get(("filename", normal, printable), get_filename, self.message, normal, printable)
+
+    def forward_name(self, normal: bool = False, printable: bool = False) -> str:
+        # The forwarded message's origin sender's name
+        return self.get(("forward_name", normal, printable), get_forward_name, self.message, normal, printable)
+
+    def full_name(self, normal: bool = False, printable: bool = False) -> str:
+        # The sender's full name
+        return self.get(("full_name", normal, printable), get_full_name, self.message.from_user, normal, printable)
+
+    def links(self) -> List[str]:
+        # The links in the entities and the buttons
+        return self.get(("links",), get_links, self.message, self.entities())
+
+    def mask(self) -> int:
+        # The bitmask of the message's properties
+        return self.get(("mask",), get_message_mask, self.message)
+
+    def text(self, normal: bool = False, printable: bool = False) -> str:
+        # The text including links and buttons
+        return self.get(("text", normal, printable), get_text, self.message, normal, printable)
+
+
+def get_features(message: Message) -> MessageFeatures:
+    # Get the features of the message being checked, other messages get new ones
+    result = None
+    try:
+        result = getattr(glovar.context, "features", None)
+
+        if result is not None and result.message is message:
+            return result
+    except Exception as e:
+        logger.warning(f"Get features error: {e}", exc_info=True)
+
+    return MessageFeatures(message)
+
+
+def get_mask(properties: Iterable[str]) -> int:
+    # Get the bitmask of the properties
+    result = 0
+    try:
+        for the_property in properties:
+            result |= 1 << glovar.message_properties.index(the_property)
+    except Exception as e:
+        logger.warning(f"Get mask error: {e}", exc_info=True)
+
+    return result
+
+
+def get_message_mask(message: Message) -> int:
+    # Get the bitmask of the message's properties, every message has the "always" property
+    result = get_mask(["always"])
+    try:
+        text = message.text or message.caption or ""
+        properties = {
+            "animation": message.animation,
+            "audio": message.audio,
+            "command": text.startswith("/"),
+            "contact": message.contact,
+            "document": message.document,
+            "game": message.game,
+            "location": message.location or message.venue,
+            "photo": message.photo,
+            "service": message.service,
+            "sticker": message.sticker,
+            "text": text or message.reply_markup,
+            "via": message.via_bot,
+            "video": message.video,
+            "video_note": message.video_note,
+            "voice": message.voice
+        }
+        result |= get_mask(the_property for the_property in properties if properties[the_property])
+    except Exception as e:
+        logger.warning(f"Get message mask error: {e}", exc_info=True)
+        result = get_mask(glovar.message_properties)
+
+    return result
+
+
+def set_features(message: Message) -> MessageFeatures:
+    # Share the message's features with every check of the current message
+    result = MessageFeatures(message)
+    try:
+        glovar.context.features = result
+    except Exception as e:
+        logger.warning(f"Set features error: {e}", exc_info=True)
+
+    return result
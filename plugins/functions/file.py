@@ -17,23 +17,92 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from os import remove
+from copy import deepcopy
+from json import dumps as json_dumps
+from os import O_RDONLY, close, fsync, listdir, makedirs, open as os_open, remove, replace
 from os.path import exists
-from pickle import dump
-from shutil import copyfile
-from typing import Any
+from pickle import dump, dumps, load
+from shutil import rmtree
+from time import perf_counter, sleep
+from typing import Any, Iterator, List
 
 from pyAesCrypt import decryptFile, encryptFile
 from pyrogram import Client
 
 from .. import glovar
 from .etc import random_str, thread
+from .store import apply_user, commit_store
 from .telegram import download_media
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+class GroupShards:
+    # The groups' data of a file, every group is kept in its own file and loaded on first use
+
+    def __init__(self, file: str):
+        self.file = file
+        self.data = {}
+        self.unloaded = {int(gid) for gid in listdir("data/groups") if exists(f"data/groups/{gid}/{file}")}
+
+    def __contains__(self, gid: int) -> bool:
+        return self.get(gid) is not None
+
+    def __getitem__(self, gid: int) -> Any:
+        self.load(gid)
+        return self.data[gid]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(set(self.data) | self.unloaded))
+
+    def __len__(self) -> int:
+        return len(set(self.data) | self.unloaded)
+
+    def __setitem__(self, gid: int, value: Any) -> None:
+        self.unloaded.discard(gid)
+        self.data[gid] = value
+
+    def get(self, gid: int, default: Any = None) -> Any:
+        self.load(gid)
+        return self.data.get(gid, default)
+
+    def load(self, gid: int) -> bool:
+        # Load the group's data if it is not loaded yet
+        # A group that can not be read stays unloaded and raises, so it is never mistaken for a new group
+        if gid not in self.unloaded:
+            return True
+
+        with glovar.locks["shard"]:
+            if gid not in self.unloaded:
+                return True
+
+            for path in [f"data/groups/{gid}/{self.file}", f"data/groups/{gid}/.{self.file}"]:
+                try:
+                    with open(path, "rb") as f:
+                        self.data[gid] = load(f)
+
+                    break
+                except Exception as e:
+                    logger.error(f"Load {path} error: {e}", exc_info=True)
+            else:
+                logger.critical(f"Load group {gid} {self.file} backup error")
+                raise OSError(f"[DATA CORRUPTION] {gid} {self.file}")
+
+            self.unloaded.discard(gid)
+
+        return True
+
+    def pop(self, gid: int, default: Any = None) -> Any:
+        # The data of a left group is dropped even if it can not be read
+        try:
+            self.load(gid)
+        except OSError:
+            self.unloaded.discard(gid)
+
+        return self.data.pop(gid, default)
+
+
 def crypt_file(operation: str, file_in: str, file_out: str) -> bool:
     # Encrypt or decrypt a file
     try:
@@ -81,6 +150,15 @@ def delete_file(path: str) -> bool:
     return False
 
 
+def get_data_path(key: str) -> str:
+    # Get the path of a data file, the groups' data is kept in one file per group
+    if "/" in key:
+        file, gid = key.split("/")
+        return f"data/groups/{gid}/{file}"
+
+    return f"data/{key}"
+
+
 def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     # Download file, get it's path on local machine
     final_path = ""
@@ -112,10 +190,81 @@ def get_new_path(extension: str = "") -> str:
     return result
 
 
-def save(file: str) -> bool:
-    # Save a global variable to a file
+def get_snapshot(data: Any) -> bytes:
+    # Get a consistent copy of the data, pickling builtin types never releases the GIL
+    result = b""
+    for _ in range(3):
+        try:
+            result = dumps(data)
+            break
+        except RuntimeError as e:
+            logger.warning(f"Get snapshot error: {e}", exc_info=True)
+
+    return result
+
+
+def init_shards() -> bool:
+    # Split the groups' data into one file per group on the first run, then load every group on first use
+    try:
+        if not exists("data/groups"):
+            # Build the files aside, so an interrupted split is simply done again on the next run
+            if exists("data/groups.tmp"):
+                rmtree("data/groups.tmp")
+
+            for file in glovar.shard_files:
+                for gid, data in eval(f"glovar.{file}").items():
+                    if not save_snapshot(f"data/groups.tmp/{gid}/{file}", get_snapshot(data)):
+                        raise OSError(f"Split {file} of {gid} failed")
+
+            makedirs("data/groups.tmp", exist_ok=True)
+            replace("data/groups.tmp", "data/groups")
+
+        glovar.configs = GroupShards("configs")
+        glovar.message_ids = GroupShards("message_ids")
+
+        return True
+    except Exception as e:
+        logger.critical(f"Init shards error: {e}", exc_info=True)
+        raise SystemExit("[DATA CORRUPTION]")
+
+
+def restore_groups(file: str, data: dict) -> bool:
+    # Replace every group's data of a file
     try:
-        thread(save_thread, (file,))
+        groups = eval(f"glovar.{file}")
+
+        for gid in list(groups):
+            if gid not in data:
+                groups.pop(gid, None)
+                save(file, gid)
+
+        for gid in data:
+            groups[gid] = data[gid]
+            save(file, gid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Restore groups error: {e}", exc_info=True)
+
+    return False
+
+
+def save(file: str, gid: int = 0) -> bool:
+    # Mark a global variable to be saved, the worker writes it in the next flush
+    try:
+        # A group's data is written to the group's own file
+        if gid and file in glovar.shard_files:
+            file = f"{file}/{gid}"
+
+        with glovar.locks["save"]:
+            glovar.save_dirty.setdefault(file, perf_counter())
+            glovar.saves_count["request"] += 1
+            glovar.saves_count["backlog"] = len(glovar.save_dirty)
+
+            if not glovar.save_started:
+                glovar.save_started = thread(save_worker, ())
+
+        glovar.save_event.set()
 
         return True
     except Exception as e:
@@ -124,19 +273,171 @@ def save(file: str) -> bool:
     return False
 
 
-def save_thread(file: str) -> bool:
-    # Save thread
+def save_file(file: str, snapshot: bytes = b"") -> bool:
+    # Write a global variable, or a group's data of it, to its data file
     try:
         if not glovar:
             return True
 
-        with open(f"data/.{file}", "wb") as f:
-            dump(eval(f"glovar.{file}"), f)
+        path = get_data_path(file)
+
+        if not snapshot and "/" in file:
+            the_file, gid = file.split("/")
+            data = eval(f"glovar.{the_file}").get(int(gid))
+
+            # The group has been left
+            if data is None:
+                return delete_file(path) and delete_file(get_data_path(f".{the_file}/{gid}"))
+
+            snapshot = get_snapshot(data)
+        elif not snapshot:
+            snapshot = get_snapshot(eval(f"glovar.{file}"))
+
+        return save_snapshot(path, snapshot)
+    except Exception as e:
+        logger.error(f"Save file error: {e}", exc_info=True)
+
+    return False
+
+
+def save_flush() -> bool:
+    # Write every marked global variable and the user journal now
+    try:
+        with glovar.locks["file"]:
+            with glovar.locks["save"]:
+                dirty = glovar.save_dirty
+                glovar.save_dirty = {}
+                records = glovar.journal_pending
+                glovar.journal_pending = []
+
+                # Records journaled from now on may already be in the snapshot, replaying them again is harmless
+                compact = (not glovar.store_files
+                           and ("user_ids" in dirty or glovar.journal_count + len(records) > glovar.journal_limit))
+                snapshot = compact and get_snapshot(glovar.user_ids)
+
+                glovar.save_event.clear()
+
+            for file in dirty:
+                if file != "user_ids" and file not in glovar.store_files:
+                    save_file(file)
+
+            # The store's changes are committed as one transaction
+            if any(file in glovar.store_files for file in dirty):
+                commit_store()
+
+            # Compact the journal into a new snapshot, or only append the new records
+            if snapshot and save_file("user_ids", snapshot):
+                if save_journal([], "w"):
+                    glovar.journal_count = 0
+            elif records and save_journal(records, "a"):
+                glovar.journal_count += len(records)
+
+            latency = perf_counter() - min(dirty.values()) if dirty else 0.0
+
+            with glovar.locks["save"]:
+                glovar.saves_count["flush"] += 1
+                glovar.saves_count["write"] += len(dirty)
+                glovar.saves_count["backlog"] = len(glovar.save_dirty)
+                glovar.saves_count["latency"] = latency
+                glovar.saves_count["latency_max"] = max(glovar.saves_count["latency_max"], latency)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save flush error: {e}", exc_info=True)
+
+    return False
+
+
+def save_journal(records: List[list], mode: str) -> bool:
+    # Append the records to the user journal, or rewrite the journal with them
+    try:
+        with open("data/user_ids.journal", mode) as f:
+            f.write("".join(f"{json_dumps(record, separators=(',', ':'))}\n" for record in records))
+            f.flush()
+            fsync(f.fileno())
+
+        return True
+    except Exception as e:
+        logger.error(f"Save journal error: {e}", exc_info=True)
+
+    return False
+
+
+def save_snapshot(path: str, snapshot: bytes) -> bool:
+    # Write the snapshot to the path, the previous file is kept as the backup
+    try:
+        if not snapshot:
+            return False
+
+        directory, name = path.rsplit("/", 1)
+        makedirs(directory, exist_ok=True)
+
+        with open(f"{directory}/.{name}.tmp", "wb") as f:
+            f.write(snapshot)
+            f.flush()
+            fsync(f.fileno())
+
+        # If it stops between the two replaces, the data file is missing and the backup is loaded
+        if exists(path):
+            replace(path, f"{directory}/.{name}")
+
+        replace(f"{directory}/.{name}.tmp", path)
 
-        copyfile(f"data/.{file}", f"data/{file}")
+        # The renames are only durable once the directory is synced
+        fd = os_open(directory, O_RDONLY)
+
+        try:
+            fsync(fd)
+        finally:
+            close(fd)
 
         return True
     except Exception as e:
-        logger.error(f"Save thread error: {e}", exc_info=True)
+        logger.error(f"Save snapshot error: {e}", exc_info=True)
 
     return False
+
+
+def save_user(record: list) -> bool:
+    # Change a user's status and journal the change, instead of saving the whole user_ids
+    try:
+        # The change and its record are made under one lock, so the journal is replayed in the order of the changes
+        with glovar.locks["save"]:
+            if record[0] == "clear":
+                for uid in list(glovar.user_ids):
+                    glovar.user_ids[uid][record[1]] = {}
+            elif record[0] == "reset":
+                glovar.user_ids[record[1]] = deepcopy(glovar.default_user_status)
+            else:
+                glovar.user_ids[record[1]][record[0]][record[2]] = record[3]
+
+            if glovar.store_files:
+                apply_user(record)
+            else:
+                glovar.journal_pending.append(record)
+                glovar.saves_count["record"] += 1
+
+                if not glovar.save_started:
+                    glovar.save_started = thread(save_worker, ())
+
+        if glovar.store_files:
+            return save("user_ids")
+
+        glovar.save_event.set()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save user error: {e}", exc_info=True)
+
+    return False
+
+
+def save_worker() -> None:
+    # Write the marked global variables, every file is written once per flush window
+    while True:
+        try:
+            glovar.save_event.wait()
+            sleep(glovar.save_window)
+            save_flush()
+        except Exception as e:
+            logger.warning(f"Save worker error: {e}", exc_info=True)
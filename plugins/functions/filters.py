@@ -18,20 +18,19 @@
 
 import logging
 import re
-from copy import deepcopy
-from string import ascii_lowercase
-from typing import Match, Optional, Union
+from typing import Dict, List, Match, Optional, Set, Union
 
 from pyrogram import CallbackQuery, Client, Filters, Message, User
 
 from .. import glovar
-from .channel import get_content
-from .etc import get_channel_link, get_command_type, get_entity_text, get_now, get_links, get_md5sum
-from .etc import get_stripped_link, get_text, thread
+from .etc import get_channel_link, get_command_type, get_emojis, get_now, get_md5sum
+from .etc import get_stripped_link, thread
+from .features import get_features, get_mask
 from .file import delete_file, get_downloaded_path, save
-from .group import get_description, get_group_sticker, get_member, get_pinned
+from .group import get_group_context, get_member
 from .ids import init_group_id
-from .image import get_file_id, get_qrcode
+from .image import get_qrcode
+from .regex import get_key, get_result, get_variants, search_ad, search_words, set_result
 from .telegram import resolve_username
 
 # Enable logging
@@ -112,7 +111,7 @@ def is_class_e(_, message: Message) -> bool:
             if short_name in glovar.except_ids["long"]:
                 return True
 
-        content = get_content(message)
+        content = get_features(message).content()
 
         if not content:
             return False
@@ -269,14 +268,163 @@ test_group = Filters.create(
 )
 
 
-def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
+def get_ad_categories(text: str, ocr: bool) -> Set[str]:
+    # Get all the ad categories the text hit
+    result = set()
+    try:
+        if not text:
+            return set()
+
+        # Use the result of the same check on the current message if possible
+        key = ("ad_", text, ocr)
+        results = getattr(glovar.context, "results", None)
+
+        if results is not None and key in results:
+            hits = results[key]
+        else:
+            # Use the result of the same text checked in any group if possible
+            cache_key = get_key(text)
+            hits = get_result(cache_key, "ad_", ocr)
+
+            if hits is None:
+                collapsed, despaced = get_variants(text)
+                hits = search_ad(collapsed, ocr)
+
+                # Try again without spaces for the categories not hit
+                if despaced:
+                    hits.update(search_ad(despaced, ocr, set(hits)))
+
+                set_result(cache_key, "ad_", ocr, hits)
+
+            if results is not None:
+                results[key] = hits
+
+        # Count
+        for c in hits:
+            glovar.hits.append((f"ad{c}", hits[c]))
+
+        result = set(hits)
+    except Exception as e:
+        logger.warning(f"Get ad categories error: {e}", exc_info=True)
+
+    return result
+
+
+def get_detection(client: Client, message: Message, need_delete: List[str]) -> str:
+    # Get the regular message's detection type, without the group's bypass
+    try:
+        # Basic data
+        gid = message.chat.id
+        features = get_features(message)
+
+        # Check detected records
+        class_c = is_class_c(None, message)
+        if not class_c:
+            # If the user is being punished
+            if is_detected_user(message):
+                return "true"
+
+            # Content
+            message_content = features.content()
+            if message_content:
+                detection = glovar.contents.get(message_content, "")
+                if detection and is_in_config(gid, detection):
+                    return detection
+
+            # Url
+            detected_url = is_detected_url(message)
+            if is_in_config(gid, detected_url):
+                return detected_url
+
+        # Check the enabled checks only
+        plan = get_plan(gid)
+
+        # Basic types messages
+        for the_type in plan.get("basic", []):
+            if is_plan_hit(client, message, the_type):
+                return the_type
+
+        # Media types messages
+        if plan.get("type") and not class_c:
+            for the_type in plan["type"]:
+                if is_plan_hit(client, message, the_type):
+                    return the_type
+
+        # Spam messages
+
+        if (plan.get("spam") or plan.get("qrc")) and not (class_c or is_class_e(None, message)):
+            message_text = features.text(True)
+
+            for the_type in plan["spam"]:
+                if is_plan_hit(client, message, the_type, message_text):
+                    return the_type
+
+            # QR code
+            if plan["qrc"]:
+                # Get the image
+                file_id, file_ref, big = features.file_id()
+                image_path = big and get_downloaded_path(client, file_id, file_ref)
+                image_path and need_delete.append(image_path)
+
+                # Check hash
+                image_hash = image_path and get_md5sum("file", image_path)
+                if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
+                    # Check declare status
+                    if is_declared_message(None, message):
+                        return ""
+
+                    # Get QR code
+                    qrcode = get_qrcode(image_path)
+                    if qrcode and not (glovar.nospam_id in glovar.admin_ids[gid] and is_ban_text(qrcode, False)):
+                        return "qrc"
+    except Exception as e:
+        logger.warning(f"Get detection error: {e}", exc_info=True)
+
+    return ""
+
+
+def get_plan(gid: int) -> Dict[str, Union[bool, List[str]]]:
+    # Get the group's check plan, only the enabled checks, cheap ones first
+    result = {}
+    try:
+        config = glovar.configs.get(gid, {})
+        plan = glovar.plans.get(gid)
+
+        # The config is replaced as a whole on every change, so the plan follows it by identity
+        if plan and plan[0] is config:
+            return plan[1]
+
+        for section in glovar.plan_checks:
+            result[section] = [the_type for the_type in glovar.plan_checks[section] if config.get(the_type)]
+
+        result["qrc"] = bool(config.get("qrc"))
+
+        # The message properties that any of the enabled checks may look at
+        properties = ["schedule"] + [the_type for the_type in glovar.types["all"] if config.get(the_type)]
+
+        if any(config.get(the_type) for the_type in glovar.types["spam"]):
+            properties.append("records")
+
+        result["mask"] = get_mask(the_property for the_type in properties
+                                 for the_property in glovar.plan_properties[the_type])
+        glovar.plans[gid] = (config, result)
+    except Exception as e:
+        logger.warning(f"Get plan error: {e}", exc_info=True)
+
+    return result
+
+
+def is_ad_text(text: str, ocr: bool, matched: str = "", categories: Set[str] = None) -> str:
     # Check if the text is ad text
     try:
         if not text:
             return ""
 
-        for c in ascii_lowercase:
-            if c != matched and is_regex_text(f"ad{c}", text, ocr):
+        if categories is None:
+            categories = get_ad_categories(text, ocr)
+
+        for c in sorted(categories):
+            if c != matched:
                 return c
     except Exception as e:
         logger.warning(f"Is ad text error: {e}", exc_info=True)
@@ -304,7 +452,8 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
             return True
 
         # ad_ + con
-        ad = is_ad_text(text, ocr)
+        categories = get_ad_categories(text, ocr)
+        ad = is_ad_text(text, ocr, categories=categories)
 
         if ad and con:
             return True
@@ -315,7 +464,7 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
 
         # ad_ + ad_
         if ad:
-            ad = is_ad_text(text, ocr, ad)
+            ad = is_ad_text(text, ocr, ad, categories)
             return bool(ad)
     except Exception as e:
         logger.warning(f"Is ban text error: {e}", exc_info=True)
@@ -338,7 +487,7 @@ def is_bio_text(text: str) -> bool:
 def is_bmd(message: Message) -> bool:
     # Check if the message is bot command:
     try:
-        text = get_text(message)
+        text = get_features(message).text()
         if (re.search("^/[a-z0-9]|^/$", text, re.I) and "/" not in text.split(" ")[0][1:]
                 and not any(re.search(f"^/{c}$", text) for c in glovar.other_commands)):
             if not get_command_type(message):
@@ -417,7 +566,7 @@ def is_detected_url(message: Message, test: bool = False) -> str:
             return ""
 
         gid = message.chat.id
-        links = get_links(message)
+        links = get_features(message).links()
         for link in links:
             detected_type = glovar.contents.get(link, "")
             if detected_type and is_in_config(gid, detected_type):
@@ -465,18 +614,9 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
     # Check the emoji type
     try:
         if message:
-            text = get_text(message, False, False)
-
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
+            text = get_features(message).text(False, False)
 
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+        emoji_dict = get_emojis(text)
 
         # Check ad
         if the_type == "ad":
@@ -521,7 +661,7 @@ def is_exe(message: Message) -> bool:
                     return True
 
         extensions.remove("com")
-        links = get_links(message)
+        links = get_features(message).links()
         for link in links:
             for file_type in extensions:
                 if re.search(f"[.]{file_type}$", link, re.I):
@@ -568,6 +708,37 @@ def is_friend_username(client: Client, gid: int, username: str, friend: bool, fr
     return False
 
 
+def is_group_bypass(client: Client, message: Message) -> bool:
+    # Check if the message is a part of the group's description, pinned message or sticker set
+    try:
+        context = get_group_context(client, message.chat.id)
+
+        if not context:
+            return False
+
+        features = get_features(message)
+        message_text = features.text()
+
+        if (context["description"] and message_text) and message_text in context["description"]:
+            return True
+
+        message_content = features.content()
+        if (context["pinned_content"] and message_content) and message_content in context["pinned_content"]:
+            return True
+
+        if (context["pinned_text"] and message_text) and message_text in context["pinned_text"]:
+            return True
+
+        if message.sticker:
+            sticker_name = message.sticker.set_name
+            if sticker_name and sticker_name == context["sticker"]:
+                return True
+    except Exception as e:
+        logger.warning(f"Is group bypass error: {e}", exc_info=True)
+
+    return False
+
+
 def is_high_score_user(user: User) -> float:
     # Check if the message is sent by a high score user
     try:
@@ -698,196 +869,29 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
 
         # Regular message
         if not (text or image_path):
-            # Bypass
-            message_content = get_content(message)
-            message_text = get_text(message)
-            description = get_description(client, gid)
-            if (description and message_text) and message_text in description:
+            # Check the message first, the group's context is only needed if the message will be handled
+            detection = get_detection(client, message, need_delete)
+            sticker = (message.sticker
+                       or message.animation
+                       or (message.document
+                           and message.document.mime_type
+                           and "gif" in message.document.mime_type))
+
+            if not (detection or sticker):
                 return ""
 
-            pinned_message = get_pinned(client, gid)
-            pinned_content = get_content(pinned_message)
-            if (pinned_content and message_content) and message_content in pinned_content:
-                return ""
-
-            pinned_text = get_text(pinned_message)
-            if (pinned_text and message_text) and message_text in pinned_text:
+            # Bypass
+            if is_group_bypass(client, message):
                 return ""
 
-            group_sticker = get_group_sticker(client, gid)
-            if message.sticker:
-                sticker_name = message.sticker.set_name
-                if sticker_name and sticker_name == group_sticker:
-                    return ""
-
-            # Check detected records
-            if not is_class_c(None, message):
-                # If the user is being punished
-                if is_detected_user(message):
-                    return "true"
-
-                # Content
-                if message_content:
-                    detection = glovar.contents.get(message_content, "")
-                    if detection and is_in_config(gid, detection):
-                        return detection
-
-                # Url
-                detected_url = is_detected_url(message)
-                if is_in_config(gid, detected_url):
-                    return detected_url
-
-            # Privacy messages
-
-            # Contact
-            if is_in_config(gid, "con"):
-                if message.contact:
-                    return "con"
-
-            # Location
-            if is_in_config(gid, "loc"):
-                if message.location or message.venue:
-                    return "loc"
-
-            # Video note
-            if is_in_config(gid, "vdn"):
-                if message.video_note:
-                    return "vdn"
-
-            # Voice
-            if is_in_config(gid, "voi"):
-                if message.voice:
-                    return "voi"
-
-            # Basic types messages
-
-            # Bot command
-            if is_in_config(gid, "bmd"):
-                if is_bmd(message):
-                    return "bmd"
-
-            # Service
-            if is_in_config(gid, "ser"):
-                if message.service:
-                    return "ser"
-
-            if not is_class_c(None, message):
-                # Animated Sticker
-                if is_in_config(gid, "ast"):
-                    if message.sticker and message.sticker.is_animated:
-                        return "ast"
-
-                # Audio
-                if is_in_config(gid, "aud"):
-                    if message.audio:
-                        return "aud"
-
-                # Document
-                if is_in_config(gid, "doc"):
-                    if message.document:
-                        return "doc"
-
-                # Game
-                if is_in_config(gid, "gam"):
-                    if message.game:
-                        return "gam"
-
-                # GIF
-                if is_in_config(gid, "gif"):
-                    if (message.animation
-                            or (message.document
-                                and message.document.mime_type
-                                and "gif" in message.document.mime_type)):
-                        return "gif"
-
-                # Via Bot
-                if is_in_config(gid, "via"):
-                    if message.via_bot:
-                        return "via"
-
-                # Video
-                if is_in_config(gid, "vid"):
-                    if message.video:
-                        return "vid"
-
-                # Sticker
-                if is_in_config(gid, "sti"):
-                    return "sti"
-
-            # Spam messages
-
-            if not (is_class_c(None, message) or is_class_e(None, message)):
-                message_text = get_text(message, True)
-
-                # AFF link
-                if is_in_config(gid, "aff"):
-                    if is_regex_text("adi", message_text):
-                        return "aff"
-
-                # Emoji
-                if is_in_config(gid, "emo"):
-                    if is_emoji("many", message_text, message):
-                        return "emo"
-
-                # Executive file
-                if is_in_config(gid, "exe"):
-                    if is_exe(message):
-                        return "exe"
-
-                # Instant messenger link
-                if is_in_config(gid, "iml"):
-                    if is_regex_text("iml", message_text):
-                        return "iml"
-
-                # Phone Number
-                if is_in_config(gid, "pho"):
-                    if is_regex_text("pho", message_text):
-                        return "pho"
-
-                # Short link
-                if is_in_config(gid, "sho"):
-                    if is_regex_text("sho", message_text):
-                        return "sho"
-
-                # Telegram link
-                if is_in_config(gid, "tgl"):
-                    if is_tgl(client, message):
-                        return "tgl"
-
-                # Telegram proxy
-                if is_in_config(gid, "tgp"):
-                    if is_regex_text("tgp", message_text):
-                        return "tgp"
-
-                # QR code
-                if is_in_config(gid, "qrc"):
-                    # Get the image
-                    file_id, file_ref, big = get_file_id(message)
-                    image_path = big and get_downloaded_path(client, file_id, file_ref)
-                    image_path and need_delete.append(image_path)
-
-                    # Check hash
-                    image_hash = image_path and get_md5sum("file", image_path)
-                    if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
-                        # Check declare status
-                        if is_declared_message(None, message):
-                            return ""
-
-                        # Get QR code
-                        qrcode = get_qrcode(image_path)
-                        if qrcode and not (glovar.nospam_id in glovar.admin_ids[gid] and is_ban_text(qrcode, False)):
-                            return "qrc"
+            if detection:
+                return detection
 
             # Schedule to delete stickers and animations
-            if (message.sticker
-                    or message.animation
-                    or (message.document
-                        and message.document.mime_type
-                        and "gif" in message.document.mime_type)):
-                mid = message.message_id
-                glovar.message_ids[gid]["stickers"][mid] = now
-                save("message_ids")
-                return ""
+            mid = message.message_id
+            glovar.message_ids[gid]["stickers"][mid] = now
+            save("message_ids", gid)
+            return ""
 
         # Preview message
         else:
@@ -939,39 +943,129 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
     return ""
 
 
-def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
+def is_plan_hit(client: Client, message: Message, the_type: str, text: str = "") -> bool:
+    # Check if the message hits one of the plan's checks
+    try:
+        # Contact
+        if the_type == "con":
+            return bool(message.contact)
+
+        # Location
+        if the_type == "loc":
+            return bool(message.location or message.venue)
+
+        # Video note
+        if the_type == "vdn":
+            return bool(message.video_note)
+
+        # Voice
+        if the_type == "voi":
+            return bool(message.voice)
+
+        # Bot command
+        if the_type == "bmd":
+            return is_bmd(message)
+
+        # Service
+        if the_type == "ser":
+            return bool(message.service)
+
+        # Animated Sticker
+        if the_type == "ast":
+            return bool(message.sticker and message.sticker.is_animated)
+
+        # Audio
+        if the_type == "aud":
+            return bool(message.audio)
+
+        # Document
+        if the_type == "doc":
+            return bool(message.document)
+
+        # Game
+        if the_type == "gam":
+            return bool(message.game)
+
+        # GIF
+        if the_type == "gif":
+            return bool(message.animation
+                        or (message.document
+                            and message.document.mime_type
+                            and "gif" in message.document.mime_type))
+
+        # Via Bot
+        if the_type == "via":
+            return bool(message.via_bot)
+
+        # Video
+        if the_type == "vid":
+            return bool(message.video)
+
+        # Sticker
+        if the_type == "sti":
+            return True
+
+        # AFF link
+        if the_type == "aff":
+            return bool(is_regex_text("adi", text))
+
+        # Emoji
+        if the_type == "emo":
+            return is_emoji("many", text, message)
+
+        # Executive file
+        if the_type == "exe":
+            return is_exe(message)
+
+        # Telegram link
+        if the_type == "tgl":
+            return is_tgl(client, message)
+
+        # Instant messenger link, phone number, short link, Telegram proxy
+        if the_type in {"iml", "pho", "sho", "tgp"}:
+            return bool(is_regex_text(the_type, text))
+    except Exception as e:
+        logger.warning(f"Is plan hit error: {e}", exc_info=True)
+
+    return False
+
+
+def is_regex_text(word_type: str, text: str, ocr: bool = False) -> Optional[Match]:
     # Check if the text hit the regex rules
     result = None
     try:
-        if text:
-            if not again:
-                text = re.sub(r"\s{2,}", " ", text)
-            elif " " in text:
-                text = re.sub(r"\s", "", text)
-            else:
-                return None
-        else:
+        if not text:
             return None
 
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
+        # Use the result of the same check on the current message if possible
+        key = (word_type, text, ocr)
+        results = getattr(glovar.context, "results", None)
 
-        for word in words:
-            if ocr and "(?# nocr)" in word:
-                continue
+        if results is not None and key in results:
+            word, result = results[key]
+        else:
+            # Use the result of the same text checked in any group if possible
+            cache_key = get_key(text)
+            cached = get_result(cache_key, word_type, ocr)
 
-            result = re.search(word, text, re.I | re.S | re.M)
+            if cached is not None:
+                word, result = cached
+            else:
+                collapsed, despaced = get_variants(text)
+                word, result = search_words(word_type, collapsed, ocr)
 
-            # Count and return
-            if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
-                return result
+                # Try again
+                if not result and despaced:
+                    word, result = search_words(word_type, despaced, ocr)
 
-        # Try again
-        return is_regex_text(word_type, text, ocr, True)
+                set_result(cache_key, word_type, ocr, (word, result))
+
+            if results is not None:
+                results[key] = (word, result)
+
+        # Count and return
+        if result:
+            glovar.hits.append((word_type, word))
     except Exception as e:
         logger.warning(f"Is regex text error: {e}", exc_info=True)
 
@@ -983,13 +1077,12 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
     try:
         # Bypass prepare
         gid = message.chat.id
-        description = get_description(client, gid).lower()
-        pinned_message = get_pinned(client, gid)
-        pinned_text = get_text(pinned_message).lower()
+        bypass_text = get_group_context(client, gid).get("bypass_text", "")
 
         # Check links
+        features = get_features(message)
         bypass = get_stripped_link(get_channel_link(message))
-        links = get_links(message)
+        links = features.links()
         tg_links = [lk.lower() for lk in links if is_regex_text("tgl", lk)]
 
         # Define a bypass link filter function
@@ -1009,10 +1102,8 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
                             return True
 
                 if (f"{bypass}/" in f"{link}/"
-                        or link in description
-                        or (link_username and link_username in description)
-                        or link in pinned_text
-                        or (link_username and link_username in pinned_text)):
+                        or link in bypass_text
+                        or (link_username and link_username in bypass_text)):
                     return True
             except Exception as ee:
                 logger.warning(f"Is bypass link error: {ee}", exc_info=True)
@@ -1024,7 +1115,7 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
             return True
 
         # Check text
-        message_text = get_text(message, True, True).lower()
+        message_text = features.text(True, True).lower()
         for bypass in bypass_list:
             message_text = message_text.replace(bypass, "")
 
@@ -1032,13 +1123,13 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
             return True
 
         # Check mentions
-        entities = message.entities or message.caption_entities
+        entities = features.entities()
         if not entities:
             return False
 
-        for en in entities:
-            if en.type == "mention":
-                username = get_entity_text(message, en)[1:].lower()
+        for en_type, en_text, en in entities:
+            if en_type == "mention":
+                username = en_text[1:].lower()
 
                 if username in glovar.invalid:
                     continue
@@ -1046,16 +1137,13 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
                 if message.chat.username and username == message.chat.username.lower():
                     continue
 
-                if username in description:
-                    continue
-
-                if username in pinned_text:
+                if username in bypass_text:
                     continue
 
                 if not is_friend_username(client, gid, username, friend):
                     return True
 
-            if en.type == "user":
+            if en_type == "user":
                 uid = en.user.id
                 member = get_member(client, gid, uid)
                 if member is False:
@@ -1096,9 +1184,8 @@ def is_wb_text(text: str, ocr: bool) -> bool:
                 or is_regex_text("spc", text, ocr)):
             return True
 
-        for c in ascii_lowercase:
-            if c not in {"i"} and is_regex_text(f"ad{c}", text, ocr):
-                return True
+        if get_ad_categories(text, ocr) - {"i"}:
+            return True
     except Exception as e:
         logger.warning(f"Is wb text error: {e}", exc_info=True)
 
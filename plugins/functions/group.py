@@ -17,12 +17,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional
+from typing import Dict, Optional
 
 from pyrogram import Chat, ChatMember, Client, Message
 
 from .. import glovar
-from .etc import code, lang, t2t, thread
+from .channel import get_content
+from .etc import code, get_text, lang, t2t, thread
 from .file import save
 from .ids import init_group_id
 from .telegram import delete_messages, get_chat, get_chat_member, get_messages, leave_chat
@@ -78,19 +79,6 @@ def get_config_text(config: dict) -> str:
     return result
 
 
-def get_description(client: Client, gid: int) -> str:
-    # Get group's description
-    result = ""
-    try:
-        group = get_group(client, gid)
-        if group and group.description:
-            result = t2t(group.description, False, False)
-    except Exception as e:
-        logger.warning(f"Get description error: {e}", exc_info=True)
-
-    return result
-
-
 def get_group(client: Client, gid: int, cache: bool = True) -> Optional[Chat]:
     # Get the group
     result = None
@@ -110,15 +98,34 @@ def get_group(client: Client, gid: int, cache: bool = True) -> Optional[Chat]:
     return result
 
 
-def get_group_sticker(client: Client, gid: int) -> str:
-    # Get group sticker set name
-    result = ""
+def get_group_context(client: Client, gid: int) -> Dict[str, str]:
+    # Get the group's description, pinned message and sticker set, prepared for the bypass checks
+    result = {}
     try:
         group = get_group(client, gid)
-        if group and group.sticker_set_name:
-            result = group.sticker_set_name
+
+        if not group:
+            return {}
+
+        # The context is computed once for every cached chat
+        the_cache = glovar.group_contexts.get(gid)
+        if the_cache and the_cache[0] is group:
+            return the_cache[1]
+
+        description = t2t(group.description, False, False) if group.description else ""
+        pinned_message = group.pinned_message
+        pinned_text = get_text(pinned_message)
+
+        result = {
+            "bypass_text": f"{description}\n{pinned_text}".lower(),
+            "description": description,
+            "pinned_content": get_content(pinned_message),
+            "pinned_text": pinned_text,
+            "sticker": group.sticker_set_name or ""
+        }
+        glovar.group_contexts[gid] = (group, result)
     except Exception as e:
-        logger.warning(f"Get group sticker error: {e}", exc_info=True)
+        logger.warning(f"Get group context error: {e}", exc_info=True)
 
     return result
 
@@ -159,19 +166,6 @@ def get_message(client: Client, gid: int, mid: int) -> Optional[Message]:
     return result
 
 
-def get_pinned(client: Client, gid: int) -> Optional[Message]:
-    # Get group's pinned message
-    result = None
-    try:
-        group = get_group(client, gid)
-        if group and group.pinned_message:
-            result = group.pinned_message
-    except Exception as e:
-        logger.warning(f"Get pinned error: {e}", exc_info=True)
-
-    return result
-
-
 def leave_group(client: Client, gid: int) -> bool:
     # Leave a group, clear it's data
     try:
@@ -183,10 +177,13 @@ def leave_group(client: Client, gid: int) -> bool:
         save("admin_ids")
 
         glovar.message_ids.pop(gid, {})
-        save("message_ids")
+        save("message_ids", gid)
 
         glovar.configs.pop(gid, {})
-        save("configs")
+        glovar.plans.pop(gid, None)
+        save("configs", gid)
+
+        glovar.group_contexts.pop(gid, None)
 
         return True
     except Exception as e:
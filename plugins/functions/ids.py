@@ -20,7 +20,7 @@ import logging
 from copy import deepcopy
 
 from .. import glovar
-from .file import save
+from .file import save, save_user
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -41,11 +41,12 @@ def init_group_id(gid: int) -> bool:
 
         if glovar.message_ids.get(gid) is None:
             glovar.message_ids[gid] = deepcopy(glovar.default_message_data)
-            save("message_ids")
+            save("message_ids", gid)
 
         if glovar.configs.get(gid) is None:
             glovar.configs[gid] = deepcopy(glovar.default_config)
-            save("configs")
+            glovar.plans.pop(gid, None)
+            save("configs", gid)
 
         if glovar.declared_message_ids.get(gid) is None:
             glovar.declared_message_ids[gid] = set()
@@ -70,8 +71,7 @@ def init_user_id(uid: int) -> bool:
     # Init user data
     try:
         if glovar.user_ids.get(uid) is None:
-            glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            save_user(["reset", uid])
 
         return True
     except Exception as e:
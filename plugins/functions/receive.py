@@ -18,21 +18,23 @@
 
 import logging
 import pickle
-from copy import deepcopy
 from json import loads
-from typing import Any
+from typing import Any, Set
 
 from pyrogram import Client, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from .. import glovar
-from .channel import get_content, get_debug_text, share_data
+from .channel import get_content, get_debug_text, share_data, share_regex_cost
 from .etc import code, crypt_str, general_link, get_int, get_now, get_report_record, get_stripped_link, get_text, lang
 from .etc import mention_id, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .file import restore_groups, save_user
 from .filters import is_class_e, is_declared_message_id, is_detected_user_id, is_not_allowed
 from .group import get_config_text, get_message, leave_group
 from .ids import init_group_id, init_user_id
 from .image import get_image_hash
+from .regex import benchmark_words, compile_ad, compile_words
+from .store import restore_data
 from .telegram import send_message, send_report_message
 from .timers import update_admins
 from .user import terminate_user
@@ -127,9 +129,9 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
         # Clear bad data
         if data_type == "bad":
             if the_type == "channels":
-                glovar.bad_ids["channels"] = set()
+                glovar.bad_ids["channels"].clear()
             elif the_type == "users":
-                glovar.bad_ids["users"] = set()
+                glovar.bad_ids["users"].clear()
 
             save("bad_ids")
 
@@ -147,24 +149,20 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
         # Clear user data
         if data_type == "user":
             if the_type == "all":
-                glovar.user_ids = {}
+                glovar.user_ids.clear()
+                save("user_ids")
             elif the_type == "new":
-                for uid in list(glovar.user_ids):
-                    glovar.user_ids[uid]["join"] = {}
-
-            save("user_ids")
+                save_user(["clear", "join"])
 
         # Clear watch data
         if data_type == "watch":
             if the_type == "all":
-                glovar.watch_ids = {
-                    "ban": {},
-                    "delete": {}
-                }
+                glovar.watch_ids["ban"].clear()
+                glovar.watch_ids["delete"].clear()
             elif the_type == "ban":
-                glovar.watch_ids["ban"] = {}
+                glovar.watch_ids["ban"].clear()
             elif the_type == "delete":
-                glovar.watch_ids["delete"] = {}
+                glovar.watch_ids["delete"].clear()
 
             save("watch_ids")
 
@@ -190,7 +188,8 @@ def receive_config_commit(data: dict) -> bool:
         config = data["config"]
 
         glovar.configs[gid] = config
-        save("configs")
+        glovar.plans.pop(gid, None)
+        save("configs", gid)
 
         return True
     except Exception as e:
@@ -439,7 +438,6 @@ def receive_refresh(client: Client, data: int) -> bool:
 
 def receive_regex(client: Client, message: Message, data: str) -> bool:
     # Receive regex
-    glovar.locks["regex"].acquire()
     try:
         file_name = data
         word_type = file_name.split("_")[0]
@@ -450,16 +448,55 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
         if not words_data:
             return True
 
-        pop_set = set(eval(f"glovar.{file_name}")) - set(words_data)
-        new_set = set(words_data) - set(eval(f"glovar.{file_name}"))
-        for word in pop_set:
-            eval(f"glovar.{file_name}").pop(word, 0)
+        # Benchmark the new words before they reach the message checks
+        costs = benchmark_words([w for w in words_data if w not in eval(f"glovar.{file_name}")])
+        rejected = {w for w in costs if costs[w] * 1000 > glovar.regex_budget}
+        share_regex_cost(client, word_type, costs)
+
+        receive_regex_words(file_name, words_data, rejected)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Receive regex error: {e}", exc_info=True)
+
+    return False
+
+
+def receive_regex_words(file_name: str, words_data: Any, rejected: Set[str]) -> bool:
+    # Receive regex words
+    try:
+        word_type = file_name.split("_")[0]
+
+        # Rejected words are kept in the list but never compiled
+        if rejected:
+            logger.warning(f"Rejected {len(rejected)} slow {word_type} words: {rejected}")
+
+        # Only update the list under the lock, the new snapshot is built off to the side and swapped in
+        with glovar.locks["regex"]:
+            pop_set = set(eval(f"glovar.{file_name}")) - set(words_data)
+            new_set = set(words_data) - set(eval(f"glovar.{file_name}"))
+            for word in pop_set:
+                eval(f"glovar.{file_name}").pop(word, 0)
 
-        for word in new_set:
-            eval(f"glovar.{file_name}")[word] = 0
+            for word in new_set:
+                eval(f"glovar.{file_name}")[word] = 0
 
         save(file_name)
 
+        # A removed word is benchmarked again if it comes back
+        quarantined = glovar.quarantine.get(word_type, set())
+
+        if rejected or quarantined & pop_set:
+            glovar.quarantine[word_type] = (quarantined - pop_set) | rejected
+            save("quarantine")
+
+        # Recompile the patterns
+        compile_words(word_type)
+
+        # Recombine the ad categories if possible
+        if word_type.startswith("ad") and len(word_type) == 3:
+            compile_ad()
+
         # Regenerate special characters dictionary if possible
         if file_name in {"spc_words", "spe_words"}:
             special = file_name.split("_")[0]
@@ -478,11 +515,15 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
                 for k in keys:
                     eval(f"glovar.{special}_dict")[k] = value
 
+            # Regenerate special characters translation table, spc first and then spe
+            glovar.special_table = str.maketrans({
+                k: glovar.spe_dict.get(glovar.spc_dict.get(k, k), glovar.spc_dict.get(k, k))
+                for k in set(glovar.spc_dict) | set(glovar.spe_dict)
+            })
+
         return True
     except Exception as e:
-        logger.warning(f"Receive regex error: {e}", exc_info=True)
-    finally:
-        glovar.locks["regex"].release()
+        logger.warning(f"Receive regex words error: {e}", exc_info=True)
 
     return False
 
@@ -504,8 +545,7 @@ def receive_remove_bad(data: dict) -> bool:
             glovar.watch_ids["ban"].pop(the_id, {})
             glovar.watch_ids["delete"].pop(the_id, {})
             save("watch_ids")
-            glovar.user_ids[the_id] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            save_user(["reset", the_id])
 
         save("bad_ids")
 
@@ -579,8 +619,7 @@ def receive_remove_score(data: int) -> bool:
         if not glovar.user_ids.get(uid):
             return True
 
-        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        save_user(["reset", uid])
 
         return True
     except Exception as e:
@@ -622,8 +661,22 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
-        save(the_type)
+        if the_type in glovar.store_files:
+            restore_data(the_type, the_data)
+            save(the_type)
+        elif the_type in glovar.shard_files:
+            restore_groups(the_type, the_data)
+        else:
+            exec(f"glovar.{the_type} = the_data")
+            save(the_type)
+
+        # Recompile the patterns if possible
+        word_type = the_type.split("_")[0]
+        if the_type == f"{word_type}_words" and word_type in glovar.regex:
+            compile_words(word_type)
+
+            if word_type.startswith("ad") and len(word_type) == 3:
+                compile_ad()
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
@@ -665,8 +718,7 @@ def receive_user_score(project: str, data: dict) -> bool:
             return True
 
         score = data["score"]
-        glovar.user_ids[uid]["score"][project] = score
-        save("user_ids")
+        save_user(["score", uid, project, score])
 
         return True
     except Exception as e:
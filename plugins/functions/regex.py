@@ -0,0 +1,718 @@
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+from collections import deque
+from multiprocessing import get_all_start_methods, get_context
+from string import ascii_lowercase
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Match, Optional, Pattern, Set, Tuple, Union
+
+from .. import glovar
+from .etc import get_md5sum
+from .file import save
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def benchmark_words(words: List[str], corpus: List[str] = None, repeat: int = 1) -> Dict[str, float]:
+    # Time the words against the corpus in a killable worker process, return the max cost of each word
+    result = {}
+    try:
+        corpus = corpus or glovar.regex_corpus
+
+        # A spawned worker would run main.py again, so time in this process if fork is not available
+        if "fork" not in get_all_start_methods():
+            costs = []
+            benchmark_worker(words, corpus, glovar.regex_budget, repeat, costs.append)
+
+            for word, cost, error in costs:
+                error and logger.warning(f"Benchmark word {word} error: {error}")
+                result[word] = cost
+
+            return result
+
+        context = get_context("fork")
+        timeout = glovar.regex_budget / 1000 * len(corpus) * repeat + 1
+        pending = list(words)
+
+        while pending:
+            # A pipe is written without a feeder thread, which a running regex would starve
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=benchmark_worker,
+                                      args=(pending, corpus, glovar.regex_budget, repeat, sender.send))
+            process.daemon = True
+            process.start()
+            done = 0
+
+            try:
+                for word in pending:
+                    if not receiver.poll(timeout):
+                        # The worker is stuck in the word, kill it and go on with the rest
+                        result[word] = float("inf")
+                        done += 1
+                        break
+
+                    _, cost, error = receiver.recv()
+                    error and logger.warning(f"Benchmark word {word} error: {error}")
+                    result[word] = cost
+                    done += 1
+            finally:
+                process.terminate()
+                process.join()
+                receiver.close()
+                sender.close()
+
+            pending = pending[done:]
+    except Exception as e:
+        logger.warning(f"Benchmark words error: {e}", exc_info=True)
+
+    return result
+
+
+def benchmark_worker(words: List[str], corpus: List[str], budget: int, repeat: int, put: Callable) -> bool:
+    # Time every word against the corpus, stop timing the word once it is over the budget
+    # A forked worker may inherit a held logging lock, so it sends the errors back instead of logging them
+    for word in words:
+        most = 0.0
+        error = ""
+
+        try:
+            pattern = re.compile(word, re.I | re.M | re.S)
+
+            for text in corpus:
+                # The best of the runs, one run within the budget is enough
+                best = float("inf")
+
+                for _ in range(repeat):
+                    start = perf_counter()
+                    pattern.search(text)
+                    best = min(best, perf_counter() - start)
+
+                    if best * 1000 <= budget:
+                        break
+
+                most = max(most, best)
+
+                if most * 1000 > budget:
+                    break
+        except Exception as e:
+            error = str(e)
+
+        put((word, most, error))
+
+    return True
+
+
+def compile_ad() -> bool:
+    # Combine the ad categories' compiled words, so one scan finds all matched categories
+    glovar.compile_locks["ad_"].acquire()
+    try:
+        base = glovar.compiled_ad.get("generation", 0)
+        categories = {c: glovar.compiled[f"ad{c}"] for c in ascii_lowercase if glovar.compiled.get(f"ad{c}")}
+        literals = {}
+
+        for c in categories:
+            for literal, words in categories[c]["literals"].items():
+                literals.setdefault(literal, []).extend((c, word) for word in words)
+
+        return publish("ad_", base, {
+            "categories": categories,
+            "literals": literals,
+            "automaton": get_automaton(literals)
+        })
+    except Exception as e:
+        logger.warning(f"Compile ad error: {e}", exc_info=True)
+    finally:
+        glovar.compile_locks["ad_"].release()
+
+    return False
+
+
+def compile_words(word_type: str) -> bool:
+    # Compile the word type's regex patterns, publish them with a new generation
+    glovar.compile_locks[word_type].acquire()
+    try:
+        base = glovar.compiled.get(word_type, {}).get("generation", 0)
+
+        with glovar.locks["regex"]:
+            words = list(eval(f"glovar.{word_type}_words"))
+
+        # Quarantined words are too slow to run
+        quarantined = glovar.quarantine.get(word_type, set())
+        words = [w for w in words if w not in quarantined]
+        patterns = {}
+
+        for word in words:
+            try:
+                patterns[word] = re.compile(word, re.I | re.M | re.S)
+            except Exception as e:
+                logger.warning(f"Compile {word_type} word {word} error: {e}")
+
+        # Words with required literals only run when the automaton finds one of them
+        literals = {}
+        always = []
+
+        for word in patterns:
+            word_literals = get_literals(word)
+
+            if not word_literals:
+                always.append(word)
+                continue
+
+            for literal in word_literals:
+                literals.setdefault(literal, []).append(word)
+
+        if not publish(word_type, base, {
+            "patterns": patterns,
+            "order": {word: i for i, word in enumerate(patterns)},
+            "literals": literals,
+            "automaton": get_automaton(literals),
+            "matchers": {
+                False: get_matchers(always),
+                True: get_matchers([w for w in always if "(?# nocr)" not in w])
+            }
+        }):
+            return False
+
+        # The old time costs belong to the old combined patterns
+        glovar.costs.pop(word_type, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Compile words error: {e}", exc_info=True)
+    finally:
+        glovar.compile_locks[word_type].release()
+
+    return False
+
+
+def finish_context() -> bool:
+    # Drop the cached regex results of the current message
+    try:
+        glovar.context.__dict__.clear()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Finish context error: {e}", exc_info=True)
+
+    return False
+
+
+def get_automaton(literals: Iterable[str]) -> Tuple[List[Dict[str, int]], List[int], List[Tuple[str, ...]]]:
+    # Build an Aho-Corasick automaton of the literals
+    goto = [{}]
+    fail = [0]
+    output = [()]
+    try:
+        # Trie
+        for literal in literals:
+            state = 0
+
+            for char in literal:
+                next_state = goto[state].get(char)
+
+                if next_state is None:
+                    goto.append({})
+                    fail.append(0)
+                    output.append(())
+                    next_state = len(goto) - 1
+                    goto[state][char] = next_state
+
+                state = next_state
+
+            output[state] += (literal,)
+
+        # Failure links, breadth first
+        queue = deque(goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fail_state = fail[state]
+
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+
+                fail[next_state] = goto[fail_state].get(char, 0)
+                output[next_state] += output[fail[next_state]]
+    except Exception as e:
+        logger.warning(f"Get automaton error: {e}", exc_info=True)
+
+    return goto, fail, output
+
+
+def get_folded(text: str) -> str:
+    # Fold the case of the text the way the regex search does, so the literals are never missed
+    result = text
+    try:
+        result = text.translate(glovar.fold_table).casefold()
+    except Exception as e:
+        logger.warning(f"Get folded error: {e}", exc_info=True)
+
+    return result
+
+
+def get_key(text: str) -> Tuple[str, int]:
+    # Get the cross-group cache key of the text under the current word lists
+    result = ("", 0)
+    try:
+        result = (get_md5sum("string", text), glovar.generation)
+    except Exception as e:
+        logger.warning(f"Get key error: {e}", exc_info=True)
+
+    return result
+
+
+def get_literals(word: str) -> Set[str]:
+    # Get the literals that every text matching the word must contain one of
+    result = set()
+    try:
+        result = get_required(sre_parse.parse(word, re.I | re.M | re.S))
+
+        # Too short literals would let almost every text through
+        if not result or min(len(literal) for literal in result) < 2:
+            return set()
+
+        result = {get_folded(literal) for literal in result}
+    except Exception as e:
+        logger.warning(f"Get literals error: {e}", exc_info=True)
+
+    return result
+
+
+def get_matchers(words: List[str]) -> List[Tuple[Pattern, Tuple[str, ...]]]:
+    # Combine the words into alternations, one search per chunk
+    result = []
+    try:
+        mergeable = [w for w in words if is_mergeable(w)]
+        mergeable_set = set(mergeable)
+        singles = [w for w in words if w not in mergeable_set]
+
+        for i in range(0, len(mergeable), glovar.regex_chunk):
+            chunk = mergeable[i:i + glovar.regex_chunk]
+
+            # Capturing groups would disable the engine's branch prefix optimization, so only the hit is attributed
+            try:
+                pattern = re.compile("|".join(f"(?:{word})" for word in chunk), re.I | re.M | re.S)
+                result.append((pattern, tuple(chunk)))
+            except Exception as e:
+                logger.warning(f"Combine words error: {e}")
+                singles += chunk
+
+        for word in singles:
+            result.append((re.compile(word, re.I | re.M | re.S), (word,)))
+    except Exception as e:
+        logger.warning(f"Get matchers error: {e}", exc_info=True)
+
+    return result
+
+
+def get_required(parsed: Iterable[tuple]) -> Set[str]:
+    # Get the most selective set of literals a parsed sequence requires
+    candidates = []
+    try:
+        repeats = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                   getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT)}
+        atomic = getattr(sre_constants, "ATOMIC_GROUP", sre_constants.SUBPATTERN)
+        run = ""
+
+        for op, av in parsed:
+            # Adjacent literals form one run, zero-width anchors do not break it
+            if op == sre_constants.LITERAL:
+                run += chr(av)
+                continue
+            elif op == sre_constants.AT:
+                continue
+
+            run and candidates.append({run})
+            run = ""
+
+            if op == sre_constants.SUBPATTERN:
+                required = get_required(av[-1])
+            elif op == atomic:
+                required = get_required(av)
+            elif op in repeats and av[0] >= 1:
+                required = get_required(av[2])
+            elif op == sre_constants.BRANCH:
+                branches = [get_required(branch) for branch in av[1]]
+                required = set().union(*branches) if all(branches) else set()
+            else:
+                required = set()
+
+            required and candidates.append(required)
+
+        run and candidates.append({run})
+    except Exception as e:
+        logger.warning(f"Get required error: {e}", exc_info=True)
+
+    return max(candidates, key=lambda c: min(len(literal) for literal in c), default=set())
+
+
+def get_result(key: Tuple[str, int], the_type: str, ocr: bool) -> Optional[Union[dict, tuple]]:
+    # Get the cached result of the same text checked in any group
+    result = None
+    try:
+        if not key[0]:
+            return None
+
+        with glovar.locks["cache"]:
+            verdicts = glovar.verdicts.get(key)
+
+            if verdicts is None or (the_type, ocr) not in verdicts:
+                glovar.verdicts_count["miss"] += 1
+                return None
+
+            glovar.verdicts.move_to_end(key)
+            glovar.verdicts_count["hit"] += 1
+            result = verdicts[(the_type, ocr)]
+    except Exception as e:
+        logger.warning(f"Get result error: {e}", exc_info=True)
+
+    return result
+
+
+def get_variants(text: str) -> Tuple[str, str]:
+    # Get the whitespace-collapsed and the de-spaced variants of the text, the latter is empty if the same
+    result = ("", "")
+    try:
+        texts = getattr(glovar.context, "texts", None)
+
+        if texts is not None and text in texts:
+            return texts[text]
+
+        collapsed = re.sub(r"\s{2,}", " ", text)
+        despaced = re.sub(r"\s", "", collapsed) if " " in collapsed else ""
+        result = (collapsed, despaced)
+
+        if texts is not None:
+            texts[text] = result
+    except Exception as e:
+        logger.warning(f"Get variants error: {e}", exc_info=True)
+
+    return result
+
+
+def is_mergeable(word: str) -> bool:
+    # Check if the word can be put into an alternation without changing its meaning
+    try:
+        # Group references, named groups, conditionals and global inline flags depend on the word's own groups
+        if re.search(r"\\[1-9]|\\g<|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)", word):
+            return False
+
+        return True
+    except Exception as e:
+        logger.warning(f"Is mergeable error: {e}", exc_info=True)
+
+    return False
+
+
+def merge_count() -> Set[str]:
+    # Merge the pending regex hits into the word lists, the caller should hold the regex lock
+    result = set()
+    try:
+        while glovar.hits:
+            word_type, word = glovar.hits.popleft()
+            words = eval(f"glovar.{word_type}_words")
+
+            # The word may have been removed by an update
+            if word not in words:
+                continue
+
+            words[word] += 1
+            result.add(word_type)
+    except Exception as e:
+        logger.warning(f"Merge count error: {e}", exc_info=True)
+
+    return result
+
+
+def publish(word_type: str, base: int, compiled: dict) -> bool:
+    # Publish the compiled snapshot with a new generation, drop the cached results of the old ones
+    try:
+        with glovar.locks["cache"]:
+            current = glovar.compiled_ad if word_type == "ad_" else glovar.compiled.get(word_type, {})
+
+            # Never replace a snapshot newer than the one this was compiled after
+            if current.get("generation", 0) != base:
+                return False
+
+            glovar.generation += 1
+            compiled["generation"] = glovar.generation
+
+            if word_type == "ad_":
+                glovar.compiled_ad = compiled
+            else:
+                glovar.compiled[word_type] = compiled
+
+            glovar.verdicts.clear()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Publish error: {e}", exc_info=True)
+
+    return False
+
+
+def quarantine_words() -> Dict[str, Dict[str, List[float]]]:
+    # Quarantine the words that exceeded the time budget, return their costs
+    result = {}
+    try:
+        while glovar.slow:
+            word_type, words, text, _ = glovar.slow.popleft()
+            patterns = glovar.compiled.get(word_type, {}).get("patterns", {})
+            count, total, most = glovar.costs.get(word_type, {}).get(words, [0, 0.0, 0.0])
+
+            # The hot path's time may include waiting for other threads, so every word is timed again on its own
+            done = glovar.quarantine.get(word_type, set()) | set(result.get(word_type, {}))
+            costs = benchmark_words([w for w in words if w in patterns and w not in done], [text], glovar.regex_repeat)
+
+            for word in costs:
+                if costs[word] * 1000 <= glovar.regex_budget:
+                    continue
+
+                # Only a word that is slow again and again is quarantined
+                offences = glovar.offences.setdefault(word_type, {})
+                offences[word] = offences.get(word, 0) + 1
+
+                if offences[word] >= glovar.regex_offences:
+                    offences.pop(word, None)
+                    result.setdefault(word_type, {})[word] = [costs[word], count, most]
+
+        for word_type in result:
+            glovar.quarantine.setdefault(word_type, set()).update(result[word_type])
+            compile_words(word_type)
+
+        # Keep the slow words out after a restart
+        result and save("quarantine")
+
+        if any(word_type.startswith("ad") and len(word_type) == 3 for word_type in result):
+            compile_ad()
+    except Exception as e:
+        logger.warning(f"Quarantine words error: {e}", exc_info=True)
+
+    return result
+
+
+def save_count() -> bool:
+    # Merge the pending regex hits, save the changed word lists
+    try:
+        with glovar.locks["regex"]:
+            word_types = merge_count()
+
+        for word_type in word_types:
+            save(f"{word_type}_words")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save count error: {e}", exc_info=True)
+
+    return False
+
+
+def scan_automaton(automaton: Tuple[List[Dict[str, int]], List[int], List[Tuple[str, ...]]], text: str) -> Set[str]:
+    # Get the automaton's literals found in the text
+    result = set()
+    try:
+        goto, fail, output = automaton
+
+        if len(goto) == 1:
+            return set()
+
+        state = 0
+
+        for char in get_folded(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+            output[state] and result.update(output[state])
+    except Exception as e:
+        logger.warning(f"Scan automaton error: {e}", exc_info=True)
+
+    return result
+
+
+def search_ad(text: str, ocr: bool, skip: Set[str] = None) -> Dict[str, str]:
+    # Search the text with all ad categories at once, return the matched word of every category
+    result = {}
+    try:
+        skip = skip or set()
+
+        # Published snapshots are never changed, so reading one needs no lock
+        compiled = glovar.compiled_ad
+
+        categories = compiled.get("categories", {})
+
+        # Only the words whose literals are in the text can match
+        literals = compiled.get("literals", {})
+        candidates = {(c, word) for literal in scan_automaton(compiled.get("automaton", ([{}], [0], [()])), text)
+                      for c, word in literals[literal]}
+
+        for c, word in sorted(candidates, key=lambda x: (x[0], categories[x[0]]["order"][x[1]])):
+            if c in result or c in skip:
+                continue
+
+            if ocr and "(?# nocr)" in word:
+                continue
+
+            if search_pattern(f"ad{c}", categories[c]["patterns"][word], (word,), text):
+                result[c] = word
+
+        for c in categories:
+            if c in result or c in skip:
+                continue
+
+            word, _ = search_matchers(f"ad{c}", categories[c], text, ocr)
+
+            if word:
+                result[c] = word
+    except Exception as e:
+        logger.warning(f"Search ad error: {e}", exc_info=True)
+
+    return result
+
+
+def search_matchers(word_type: str, compiled: dict, text: str, ocr: bool) -> Tuple[str, Optional[Match]]:
+    # Search the text with the always-run combined patterns
+    try:
+        patterns = compiled.get("patterns", {})
+        matchers = compiled.get("matchers", {}).get(ocr, [])
+
+        for pattern, words in matchers:
+            result = search_pattern(word_type, pattern, words, text)
+
+            if not result:
+                continue
+
+            if len(words) == 1:
+                return words[0], result
+
+            # The leftmost hit belongs to the first word that matches at the same position
+            for word in words:
+                word_result = patterns[word].match(text, result.start())
+
+                if word_result:
+                    return word, word_result
+
+            for word in words:
+                word_result = patterns[word].search(text)
+
+                if word_result:
+                    return word, word_result
+    except Exception as e:
+        logger.warning(f"Search matchers error: {e}", exc_info=True)
+
+    return "", None
+
+
+def search_pattern(word_type: str, pattern: Pattern, words: Tuple[str, ...], text: str) -> Optional[Match]:
+    # Search the text with the pattern, record the time cost
+    result = None
+    try:
+        start = perf_counter()
+        result = pattern.search(text)
+        cost = perf_counter() - start
+
+        stats = glovar.costs.setdefault(word_type, {}).setdefault(words, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += cost
+        stats[2] = max(stats[2], cost)
+
+        # Leave the slow text for the timer to find and quarantine the word
+        if cost * 1000 > glovar.regex_budget:
+            glovar.slow.append((word_type, words, text, cost))
+    except Exception as e:
+        logger.warning(f"Search pattern error: {e}", exc_info=True)
+
+    return result
+
+
+def search_words(word_type: str, text: str, ocr: bool) -> Tuple[str, Optional[Match]]:
+    # Search the text with the word type's combined patterns, return the matched word
+    try:
+        # Published snapshots are never changed, so reading one needs no lock
+        compiled = glovar.compiled.get(word_type, {})
+        patterns = compiled.get("patterns", {})
+
+        # Only the words whose literals are in the text can match
+        literals = compiled.get("literals", {})
+        candidates = {word for literal in scan_automaton(compiled.get("automaton", ([{}], [0], [()])), text)
+                      for word in literals[literal]}
+
+        for word in sorted(candidates, key=compiled.get("order", {}).get):
+            if ocr and "(?# nocr)" in word:
+                continue
+
+            result = search_pattern(word_type, patterns[word], (word,), text)
+
+            if result:
+                return word, result
+
+        return search_matchers(word_type, compiled, text, ocr)
+    except Exception as e:
+        logger.warning(f"Search words error: {e}", exc_info=True)
+
+    return "", None
+
+
+def set_result(key: Tuple[str, int], the_type: str, ocr: bool, result: Union[dict, tuple]) -> bool:
+    # Cache the result of the text for the other groups
+    try:
+        if not key[0]:
+            return False
+
+        with glovar.locks["cache"]:
+            # Results of replaced word lists can never be used again
+            if key[1] != glovar.generation:
+                return False
+
+            glovar.verdicts.setdefault(key, {})[(the_type, ocr)] = result
+            glovar.verdicts.move_to_end(key)
+
+            while len(glovar.verdicts) > glovar.verdicts_limit:
+                glovar.verdicts.popitem(last=False)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set result error: {e}", exc_info=True)
+
+    return False
+
+
+def start_context() -> bool:
+    # Start caching the regex results of the current message
+    try:
+        glovar.context.texts = {}
+        glovar.context.results = {}
+
+        return True
+    except Exception as e:
+        logger.warning(f"Start context error: {e}", exc_info=True)
+
+    return False
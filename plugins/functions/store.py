@@ -0,0 +1,346 @@
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import OrderedDict
+from copy import deepcopy
+from os import remove, replace
+from os.path import exists
+from sqlite3 import Connection, connect
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class IdStore:
+    # A set of ids kept in the store
+
+    def __init__(self, the_type: str):
+        self.the_type = the_type
+
+    def __contains__(self, the_id: Union[int, str]) -> bool:
+        return bool(query("SELECT 1 FROM bad_ids WHERE type = ? AND id = ?", (self.the_type, the_id)))
+
+    def __iter__(self) -> Iterator[Union[int, str]]:
+        return iter([row[0] for row in query("SELECT id FROM bad_ids WHERE type = ?", (self.the_type,))])
+
+    def __len__(self) -> int:
+        return sum(row[0] for row in query("SELECT COUNT(*) FROM bad_ids WHERE type = ?", (self.the_type,)))
+
+    def add(self, the_id: Union[int, str]) -> None:
+        execute("INSERT OR IGNORE INTO bad_ids VALUES (?, ?)", (self.the_type, the_id))
+
+    def clear(self) -> None:
+        execute("DELETE FROM bad_ids WHERE type = ?", (self.the_type,))
+
+    def discard(self, the_id: Union[int, str]) -> None:
+        execute("DELETE FROM bad_ids WHERE type = ? AND id = ?", (self.the_type, the_id))
+
+
+class UserStore:
+    # The users' status kept in the store, the hot users and the users known to have no status are cached
+    # Only the cached users are iterated, the stored ones are changed by the user records
+
+    def __init__(self):
+        self.cache = OrderedDict()
+        self.missing = OrderedDict()
+
+    def __contains__(self, uid: int) -> bool:
+        return self.get(uid) is not None
+
+    def __getitem__(self, uid: int) -> Dict[str, Dict[Union[int, str], Union[float, int]]]:
+        result = self.get(uid)
+
+        if result is None:
+            raise KeyError(uid)
+
+        return result
+
+    def __iter__(self) -> Iterator[int]:
+        with glovar.locks["store"]:
+            return iter(list(self.cache))
+
+    def __len__(self) -> int:
+        return sum(row[0] for row in query("SELECT COUNT(*) FROM users"))
+
+    def __setitem__(self, uid: int, status: Dict[str, Dict[Union[int, str], Union[float, int]]]) -> None:
+        with glovar.locks["store"]:
+            self.put(self.cache, uid, status)
+            self.missing.pop(uid, None)
+
+    def clear(self) -> None:
+        with glovar.locks["store"]:
+            for table in ["users", "joins", "detections", "scores"]:
+                glovar.store_db.execute(f"DELETE FROM {table}")
+
+            self.cache.clear()
+            self.missing.clear()
+
+    def get(self, uid: int, default: Any = None) -> Any:
+        # The lookup and the caching are done under one lock, so a user stored meanwhile is never cached as missing
+        with glovar.locks["store"]:
+            result = self.cache.get(uid)
+
+            if result is not None:
+                self.cache.move_to_end(uid)
+                return result
+
+            if uid in self.missing:
+                self.missing.move_to_end(uid)
+                return default
+
+            result = get_user(uid)
+
+            # The lookup failed
+            if result is None:
+                return default
+
+            if not result:
+                self.put(self.missing, uid, True)
+                return default
+
+            self.put(self.cache, uid, result)
+
+        return result
+
+    @staticmethod
+    def put(cache: OrderedDict, uid: int, value: Any) -> None:
+        # Cache the value, drop the least recently used ones over the limit, the caller should hold the store lock
+        cache[uid] = value
+        cache.move_to_end(uid)
+
+        while len(cache) > glovar.store_limit:
+            cache.popitem(last=False)
+
+
+class WatchStore:
+    # The watched users of a type kept in the store
+
+    def __init__(self, the_type: str):
+        self.the_type = the_type
+
+    def __contains__(self, uid: int) -> bool:
+        return self.get(uid) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([row[0] for row in query("SELECT uid FROM watches WHERE type = ?", (self.the_type,))])
+
+    def __len__(self) -> int:
+        return sum(row[0] for row in query("SELECT COUNT(*) FROM watches WHERE type = ?", (self.the_type,)))
+
+    def __setitem__(self, uid: int, until: int) -> None:
+        execute("INSERT OR REPLACE INTO watches VALUES (?, ?, ?)", (self.the_type, uid, until))
+
+    def clear(self) -> None:
+        execute("DELETE FROM watches WHERE type = ?", (self.the_type,))
+
+    def get(self, uid: int, default: Any = None) -> Any:
+        result = query("SELECT until FROM watches WHERE type = ? AND uid = ?", (self.the_type, uid))
+        return result[0][0] if result else default
+
+    def pop(self, uid: int, default: Any = None) -> Any:
+        result = self.get(uid, default)
+        execute("DELETE FROM watches WHERE type = ? AND uid = ?", (self.the_type, uid))
+        return result
+
+
+def apply_user(record: list) -> bool:
+    # Apply a user record to the store
+    try:
+        uid = record[1] if len(record) > 1 else 0
+
+        with glovar.locks["store"]:
+            if record[0] == "clear":
+                glovar.store_db.execute(f"DELETE FROM {glovar.store_tables[record[1]]}")
+                return True
+
+            glovar.store_db.execute("INSERT OR IGNORE INTO users VALUES (?)", (uid,))
+
+            # The user has a status now
+            glovar.user_ids.missing.pop(uid, None)
+
+            if record[0] == "reset":
+                for table in ["joins", "detections", "scores"]:
+                    glovar.store_db.execute(f"DELETE FROM {table} WHERE uid = ?", (uid,))
+            else:
+                glovar.store_db.execute(f"INSERT OR REPLACE INTO {glovar.store_tables[record[0]]} VALUES (?, ?, ?)",
+                                        (uid, record[2], record[3]))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Apply user error: {e}", exc_info=True)
+
+    return False
+
+
+def commit_store() -> bool:
+    # Commit the changes made since the last flush in one transaction
+    try:
+        with glovar.locks["store"]:
+            glovar.store_db.commit()
+
+        return True
+    except Exception as e:
+        logger.error(f"Commit store error: {e}", exc_info=True)
+
+    return False
+
+
+def execute(sql: str, parameters: tuple = ()) -> bool:
+    # Execute a statement in the current transaction
+    try:
+        with glovar.locks["store"]:
+            glovar.store_db.execute(sql, parameters)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Execute error: {e}", exc_info=True)
+
+    return False
+
+
+def get_store(path: str) -> Connection:
+    # Open the store, create the tables if necessary
+    result = connect(path, check_same_thread=False)
+    result.execute("PRAGMA journal_mode = WAL")
+    result.execute("PRAGMA synchronous = NORMAL")
+    result.executescript("""
+        CREATE TABLE IF NOT EXISTS users (uid INTEGER PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS joins (uid INTEGER, gid INTEGER, time INTEGER,
+                                          PRIMARY KEY (uid, gid)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS joins_time ON joins (time);
+        CREATE TABLE IF NOT EXISTS detections (uid INTEGER, gid INTEGER, time INTEGER,
+                                               PRIMARY KEY (uid, gid)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS detections_time ON detections (time);
+        CREATE TABLE IF NOT EXISTS scores (uid INTEGER, project TEXT, score REAL,
+                                           PRIMARY KEY (uid, project)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS watches (type TEXT, uid INTEGER, until INTEGER,
+                                            PRIMARY KEY (type, uid)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS watches_until ON watches (until);
+        CREATE TABLE IF NOT EXISTS bad_ids (type TEXT, id, PRIMARY KEY (type, id)) WITHOUT ROWID;
+    """)
+
+    return result
+
+
+def get_user(uid: int) -> Optional[Dict[str, Dict[Union[int, str], Union[float, int]]]]:
+    # Get a user's status from the store, empty if the user has none, the caller should hold the store lock
+    result = None
+    try:
+        if not glovar.store_db.execute("SELECT 1 FROM users WHERE uid = ?", (uid,)).fetchall():
+            return {}
+
+        result = deepcopy(glovar.default_user_status)
+
+        for field in ["detected", "join", "score"]:
+            rows = glovar.store_db.execute(f"SELECT * FROM {glovar.store_tables[field]} WHERE uid = ?", (uid,))
+            result[field].update({row[1]: row[2] for row in rows})
+    except Exception as e:
+        logger.warning(f"Get user error: {e}", exc_info=True)
+        result = None
+
+    return result
+
+
+def import_data(db: Connection, file: str, data: dict) -> bool:
+    # Import the dict data of a file into the store
+    if file == "user_ids":
+        for uid, status in data.items():
+            db.execute("INSERT OR IGNORE INTO users VALUES (?)", (uid,))
+
+            for field in ["detected", "join", "score"]:
+                db.executemany(f"INSERT OR REPLACE INTO {glovar.store_tables[field]} VALUES (?, ?, ?)",
+                               [(uid, key, value) for key, value in status.get(field, {}).items()])
+    elif file == "watch_ids":
+        for the_type, watches in data.items():
+            db.executemany("INSERT OR REPLACE INTO watches VALUES (?, ?, ?)",
+                           [(the_type, uid, until) for uid, until in watches.items()])
+    elif file == "bad_ids":
+        for the_type, ids in data.items():
+            db.executemany("INSERT OR IGNORE INTO bad_ids VALUES (?, ?)",
+                           [(the_type, the_id) for the_id in ids])
+
+    return True
+
+
+def init_store() -> bool:
+    # Replace the users, watches and bad ids with the store, import the loaded data on the first run
+    try:
+        if not glovar.store_files:
+            return True
+
+        if not exists(glovar.store_path):
+            # Build the store aside, so an interrupted import is simply done again on the next run
+            path = f"{glovar.store_path}.tmp"
+
+            if exists(path):
+                remove(path)
+
+            db = get_store(path)
+
+            with db:
+                for file in glovar.store_files:
+                    import_data(db, file, eval(f"glovar.{file}"))
+
+            db.close()
+            replace(path, glovar.store_path)
+
+        glovar.store_db = get_store(glovar.store_path)
+        glovar.file_list = [file for file in glovar.file_list if file not in glovar.store_files]
+        glovar.user_ids = UserStore()
+        glovar.watch_ids = {the_type: WatchStore(the_type) for the_type in ["ban", "delete"]}
+        glovar.bad_ids = {the_type: IdStore(the_type) for the_type in ["channels", "users"]}
+
+        return True
+    except Exception as e:
+        logger.critical(f"Init store error: {e}", exc_info=True)
+        raise SystemExit("[STORE ERROR]")
+
+
+def query(sql: str, parameters: tuple = ()) -> List[tuple]:
+    # Query the store, the changes not committed yet are included
+    result = []
+    try:
+        with glovar.locks["store"]:
+            result = glovar.store_db.execute(sql, parameters).fetchall()
+    except Exception as e:
+        logger.warning(f"Query error: {e}", exc_info=True)
+
+    return result
+
+
+def restore_data(file: str, data: dict) -> bool:
+    # Replace the data of a file in the store
+    try:
+        if file == "user_ids":
+            glovar.user_ids.clear()
+        else:
+            for the_type in eval(f"glovar.{file}"):
+                eval(f"glovar.{file}")[the_type].clear()
+
+        with glovar.locks["store"]:
+            import_data(glovar.store_db, file, data)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Restore data error: {e}", exc_info=True)
+
+    return False
@@ -26,9 +26,10 @@ from pyrogram.errors import FloodWait
 from .. import glovar
 from .channel import get_debug_text, share_data, share_regex_count
 from .etc import code, general_link, get_now, lang, thread, wait_flood
-from .file import save
+from .file import data_to_file, get_new_path, get_snapshot, save
 from .filters import is_in_config
 from .group import leave_group
+from .regex import merge_count, quarantine_words, save_count
 from .telegram import delete_messages, get_admins, get_chat_members_count, get_group_info, get_members, send_message
 from .user import kick_user, unban_user
 
@@ -44,6 +45,19 @@ def backup_files(client: Client) -> bool:
             if not eval(f"glovar.{file}"):
                 continue
 
+            # The groups' data is gathered into one file again
+            if file in glovar.shard_files:
+                groups = eval(f"glovar.{file}")
+                file_path = data_to_file({gid: groups[gid] for gid in list(groups)})
+            elif file == "user_ids":
+                # The data file lags behind the journal, so the users' status is taken from memory
+                file_path = get_new_path()
+
+                with open(file_path, "wb") as f:
+                    f.write(get_snapshot(glovar.user_ids))
+            else:
+                file_path = f"data/{file}"
+
             # Share
             share_data(
                 client=client,
@@ -51,7 +65,7 @@ def backup_files(client: Client) -> bool:
                 action="backup",
                 action_type="data",
                 data=file,
-                file=f"data/{file}"
+                file=file_path
             )
             sleep(5)
 
@@ -170,13 +184,13 @@ def interval_hour_01(client: Client) -> bool:
 
             if now - time > 3600:
                 glovar.message_ids[gid]["purge"] = (0, 0)
+                save("message_ids", gid)
 
         # Delete stickers and animations in groups
-        with glovar.locks["message"]:
-            message_ids = deepcopy(glovar.message_ids)
-
         for gid in list(glovar.configs):
-            mid_dict = deepcopy(message_ids[gid]["stickers"])
+            with glovar.locks["message"]:
+                mid_dict = deepcopy(glovar.message_ids[gid]["stickers"])
+
             mid_list = list(filter(lambda m: now - mid_dict[m] >= glovar.time_sticker, mid_dict))
 
             if not mid_list:
@@ -185,6 +199,8 @@ def interval_hour_01(client: Client) -> bool:
             for mid in mid_list:
                 glovar.message_ids[gid]["stickers"].pop(mid, 0)
 
+            save("message_ids", gid)
+
             if is_in_config(gid, "ttd"):
                 thread(delete_messages, (client, gid, mid_list))
                 count_text = f"{len(mid_list)} {lang('messages')}"
@@ -193,14 +209,40 @@ def interval_hour_01(client: Client) -> bool:
                          f"{lang('rule')}{lang('colon')}{code(lang('rule_custom'))}\n"
                          f"{lang('sticker')}{lang('colon')}{code(count_text)}\n")
                 thread(send_message, (client, glovar.debug_channel_id, text))
-
-        save("message_ids")
     except Exception as e:
         logger.warning(f"Interval hour 01 error: {e}", exc_info=True)
 
     return False
 
 
+def interval_min_01(client: Client) -> bool:
+    # Execute every minute
+    try:
+        # Save regex hit counts
+        save_count()
+
+        # Quarantine slow regex words
+        quarantined = quarantine_words()
+
+        for word_type in quarantined:
+            for word in quarantined[word_type]:
+                cost, count, most = quarantined[word_type][word]
+                text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                        f"{lang('action')}{lang('colon')}{code(lang('regex_quarantine'))}\n"
+                        f"{lang('regex_type')}{lang('colon')}{code(word_type)}\n"
+                        f"{lang('regex_word')}{lang('colon')}{code(word)}\n"
+                        f"{lang('regex_cost')}{lang('colon')}{code(f'{cost * 1000:.0f} ms')}\n"
+                        f"{lang('regex_count')}{lang('colon')}{code(count)}\n"
+                        f"{lang('regex_max')}{lang('colon')}{code(f'{most * 1000:.0f} ms')}\n")
+                thread(send_message, (client, glovar.debug_channel_id, text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Interval min 01 error: {e}", exc_info=True)
+
+    return False
+
+
 def interval_min_10() -> bool:
     # Execute every 10 minutes
     glovar.locks["message"].acquire()
@@ -232,19 +274,17 @@ def reset_data(client: Client) -> bool:
     # Reset user data every month
     glovar.locks["message"].acquire()
     try:
-        glovar.bad_ids["users"] = set()
+        glovar.bad_ids["users"].clear()
         save("bad_ids")
 
         glovar.except_ids["temp"] = set()
         save("except_ids")
 
-        glovar.user_ids = {}
+        glovar.user_ids.clear()
         save("user_ids")
 
-        glovar.watch_ids = {
-            "ban": {},
-            "delete": {}
-        }
+        glovar.watch_ids["ban"].clear()
+        glovar.watch_ids["delete"].clear()
         save("watch_ids")
 
         # Send debug message
@@ -263,21 +303,25 @@ def reset_data(client: Client) -> bool:
 
 def send_count(client: Client) -> bool:
     # Send regex count to REGEX
-    glovar.locks["regex"].acquire()
     try:
-        for word_type in glovar.regex:
-            share_regex_count(client, word_type)
-            word_list = list(eval(f"glovar.{word_type}_words"))
-            for word in word_list:
-                eval(f"glovar.{word_type}_words")[word] = 0
+        # Only take the counts under the lock, the files are written and sent without it
+        with glovar.locks["regex"]:
+            merge_count()
+            counts = {}
+
+            for word_type in glovar.regex:
+                counts[word_type] = deepcopy(eval(f"glovar.{word_type}_words"))
+                word_list = list(eval(f"glovar.{word_type}_words"))
+                for word in word_list:
+                    eval(f"glovar.{word_type}_words")[word] = 0
 
+        for word_type in glovar.regex:
+            share_regex_count(client, word_type, counts[word_type])
             save(f"{word_type}_words")
 
         return True
     except Exception as e:
         logger.warning(f"Send count error: {e}", exc_info=True)
-    finally:
-        glovar.locks["regex"].release()
 
     return False
 
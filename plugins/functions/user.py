@@ -23,10 +23,11 @@ from typing import Union
 from pyrogram import ChatPermissions, Client, Message
 
 from .. import glovar
-from .etc import crypt_str, get_forward_name, get_full_name, get_now, lang, thread
+from .etc import crypt_str, get_now, lang, thread
 from .channel import ask_for_help, declare_message, forward_evidence, send_debug, share_bad_user
 from .channel import share_watch_user, update_score
-from .file import save
+from .features import get_features
+from .file import save, save_user
 from .group import delete_message
 from .filters import is_class_d, is_class_e_user, is_declared_message, is_detected_user, is_high_score_user
 from .filters import is_limited_user, is_new_user, is_watch_user, is_wb_text
@@ -61,7 +62,7 @@ def add_detected_user(gid: int, uid: int, now: int) -> bool:
             return False
 
         previous = glovar.user_ids[uid]["detected"].get(gid)
-        glovar.user_ids[uid]["detected"][gid] = now
+        save_user(["detected", uid, gid, now])
 
         return bool(previous)
     except Exception as e:
@@ -143,8 +144,9 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
         now = message.date or get_now()
 
         if the_type in glovar.types["spam"]:
-            full_name = get_full_name(message.from_user, True, True)
-            forward_name = get_forward_name(message, True, True)
+            features = get_features(message)
+            full_name = features.full_name(True, True)
+            forward_name = features.forward_name(True, True)
             if ((is_wb_text(full_name, False) or is_wb_text(forward_name, False))
                     and (full_name not in glovar.except_ids["long"] and forward_name not in glovar.except_ids["long"])
                     and not is_class_e_user(message.from_user)):
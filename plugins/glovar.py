@@ -19,15 +19,19 @@
 import logging
 import pickle
 from codecs import getdecoder
+from collections import OrderedDict, deque
 from configparser import RawConfigParser
+from copy import deepcopy
+from json import loads
 from os import mkdir
 from os.path import exists
 from shutil import rmtree
+from sqlite3 import Connection
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Tuple, Union
+from threading import Event, Lock, local
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
 
-from emoji import UNICODE_EMOJI
+from emoji import UNICODE_EMOJI, __version__ as emoji_version
 from pyrogram import Chat, ChatMember
 
 # Enable logging
@@ -78,6 +82,8 @@ invalid: Union[str, Set[str]] = ""
 limit_track: int = 0
 project_link: str = ""
 project_name: str = ""
+regex_budget: int = 200
+store: str = ""
 time_ban: int = 0
 time_new: int = 0
 time_punish: int = 0
@@ -138,6 +144,8 @@ try:
     limit_track = int(config["custom"].get("limit_track", limit_track))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    regex_budget = int(config["custom"].get("regex_budget", regex_budget))
+    store = config["custom"].get("store", store)
     time_ban = int(config["custom"].get("time_ban", time_ban))
     time_new = int(config["custom"].get("time_new", time_new))
     time_punish = int(config["custom"].get("time_punish", time_punish))
@@ -298,6 +306,23 @@ lang: Dict[str, str] = {
     "from_name": (zh_cn and "来源名称") or "Forward Name",
     "contact": (zh_cn and "联系方式") or "Contact Info",
     "more": (zh_cn and "附加信息") or "Extra Info",
+    # Regex
+    "regex_count": (zh_cn and "执行次数") or "Run Count",
+    "regex_cost": (zh_cn and "本次耗时") or "Time Cost",
+    "regex_max": (zh_cn and "最长耗时") or "Max Time Cost",
+    "regex_quarantine": (zh_cn and "隔离规则") or "Quarantine Regex",
+    "regex_type": (zh_cn and "规则类别") or "Regex Type",
+    "regex_word": (zh_cn and "规则内容") or "Regex Pattern",
+    # Status
+    "plan_fast": (zh_cn and "快速放行消息") or "Fast Path Messages",
+    "plan_full": (zh_cn and "完整检查消息") or "Fully Checked Messages",
+    "saves_backlog": (zh_cn and "待写入文件") or "Pending Data Files",
+    "saves_latency": (zh_cn and "写入延迟") or "Save Latency",
+    "saves_record": (zh_cn and "用户变更记录") or "Journaled User Changes",
+    "saves_request": (zh_cn and "保存请求") or "Save Requests",
+    "saves_write": (zh_cn and "写入文件") or "Data Files Written",
+    "verdicts_hit": (zh_cn and "规则缓存命中") or "Regex Cache Hits",
+    "verdicts_miss": (zh_cn and "规则缓存未命中") or "Regex Cache Misses",
     # Special Types
     "con": (zh_cn and "联系人") or "Contact",
     "loc": (zh_cn and "定位地址") or "Location",
@@ -394,11 +419,65 @@ chats: Dict[int, Chat] = {}
 cleaned_ids: Set[int] = set()
 # cleaned_ids = {-10012345678}
 
+compiled: Dict[str, Dict[str, Union[int, dict, tuple]]] = {}
+# compiled = {
+#     "type": {
+#         "generation": 1,
+#         "patterns": {
+#             "regex": re.compile("regex", re.I | re.M | re.S)
+#         },
+#         "order": {
+#             "regex": 0
+#         },
+#         "literals": {
+#             "literal": ["regex"]
+#         },
+#         "automaton": (goto, fail, output),
+#         "matchers": {
+#             False: [(re.compile("(?:regex)|(?:regex)"), ("regex", "regex"))],
+#             True: [(re.compile("(?:regex)|(?:regex)"), ("regex", "regex"))]
+#         }
+#     }
+# }
+
+compiled_ad: Dict[str, Union[int, dict, tuple]] = {}
+# compiled_ad = {
+#     "generation": 1,
+#     "categories": {
+#         "a": compiled["ada"]
+#     },
+#     "literals": {
+#         "literal": [("a", "regex")]
+#     },
+#     "automaton": (goto, fail, output)
+# }
+
 contents: Dict[str, str] = {}
 # contents = {
 #     "content": "tgl"
 # }
 
+context: local = local()
+# context.texts = {
+#     "text": ("collapsed text", "despaced text")
+# }
+# context.results = {
+#     ("type", "text", False): ("regex", Match)
+# }
+
+# ASCII control characters except "\t", "\n" and "\r"
+control_table: Dict[int, None] = dict.fromkeys([*range(9), 11, 12, *range(14, 32), 127])
+
+converter: local = local()
+# converter.t2s = OpenCC("t2s.json")
+
+costs: Dict[str, Dict[Tuple[str, ...], List[float]]] = {}
+# costs = {
+#     "type": {
+#         ("regex",): [1, 0.001, 0.001]
+#     }
+# }
+
 declared_message_ids: Dict[int, Set[int]] = {}
 # declared_message_ids = {
 #     -10012345678: {123}
@@ -465,14 +544,56 @@ default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
     }
 }
 
-emoji_set: Set[str] = set(UNICODE_EMOJI)
+emoji_trie: Dict[str, dict] = {}
+# emoji_trie = {
+#     "👍": {
+#         "": "👍",
+#         "🏻": {
+#             "": ""
+#         }
+#     }
+# }
+
+# re.I treats the dotless and the dotted i as i, but casefold does not
+fold_table: Dict[int, str] = str.maketrans({"ı": "i", "İ": "i"})
+
+generation: int = 0
+
+group_contexts: Dict[int, Tuple[Chat, Dict[str, str]]] = {}
+# group_contexts = {
+#     -10012345678: (Chat, {
+#         "bypass_text": "text",
+#         "description": "text",
+#         "pinned_content": "content",
+#         "pinned_text": "text",
+#         "sticker": "name"
+#     })
+# }
+
+hits: Deque[Tuple[str, str]] = deque()
+# hits = deque([("type", "regex")])
+
+journal_count: int = 0
+
+journal_limit: int = 100000
+
+journal_pending: List[list] = []
+# journal_pending = [
+#     ["join", 12345678, -10012345678, 1512345678],
+#     ["reset", 12345678]
+# ]
 
 locks: Dict[str, Lock] = {
     "admin": Lock(),
+    "cache": Lock(),
     "config": Lock(),
+    "file": Lock(),
     "message": Lock(),
     "receive": Lock(),
     "regex": Lock(),
+    "save": Lock(),
+    "shard": Lock(),
+    "store": Lock(),
     "test": Lock(),
     "text": Lock()
 }
@@ -484,6 +605,17 @@ members: Dict[int, Dict[int, ChatMember]] = {}
 #     }
 # }
 
+message_properties: List[str] = ["always", "animation", "audio", "command", "contact", "document", "game",
+                                  "location", "photo", "service", "sticker", "text", "via", "video", "video_note",
+                                  "voice"]
+
+offences: Dict[str, Dict[str, int]] = {}
+# offences = {
+#     "type": {
+#         "regex": 1
+#     }
+# }
+
 other_commands: Set[str] = {
     "admin",
     "admins",
@@ -532,9 +664,64 @@ other_commands: Set[str] = {
     "white"
 }
 
+plan_checks: Dict[str, List[str]] = {
+    "basic": ["con", "loc", "vdn", "voi", "bmd", "ser"],
+    "type": ["ast", "aud", "doc", "gam", "gif", "via", "vid", "sti"],
+    "spam": ["aff", "emo", "exe", "iml", "pho", "sho", "tgl", "tgp"]
+}
+
+plan_counts: Dict[str, int] = {
+    "fast": 0,
+    "full": 0
+}
+
+plan_properties: Dict[str, List[str]] = {
+    "con": ["contact"],
+    "loc": ["location"],
+    "vdn": ["video_note"],
+    "voi": ["voice"],
+    "bmd": ["command"],
+    "ser": ["service"],
+    "ast": ["sticker"],
+    "aud": ["audio"],
+    "doc": ["document"],
+    "gam": ["game"],
+    "gif": ["animation", "document"],
+    "via": ["via"],
+    "vid": ["video"],
+    "sti": ["always"],
+    "exe": ["document", "text"],
+    "emo": ["text"],
+    "aff": ["text"],
+    "iml": ["text"],
+    "pho": ["text"],
+    "sho": ["text"],
+    "tgl": ["text"],
+    "tgp": ["text"],
+    "qrc": ["animation", "audio", "document", "game", "photo", "sticker", "video", "video_note"],
+    "records": ["always"],
+    "schedule": ["animation", "document", "sticker"]
+}
+
+plans: Dict[int, Tuple[dict, Dict[str, Union[bool, List[str]]]]] = {}
+# plans = {
+#     -10012345678: (config, {
+#         "basic": ["bmd", "ser"],
+#         "type": [],
+#         "spam": [],
+#         "qrc": False,
+#         "mask": 1024
+#     })
+# }
+
 purged_ids: Set[int] = set()
 # purged_ids = {-10012345678}
 
+quarantine: Dict[str, Set[str]] = {}
+# quarantine = {
+#     "type": {"regex"}
+# }
+
 receivers: Dict[str, List[str]] = {
     "bad": ["ANALYZE", "APPLY", "AVATAR", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
             "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TICKET", "TIP", "USER", "WARN", "WATCH"],
@@ -575,10 +762,77 @@ for c in ascii_lowercase:
 
 regex["adi"] = True
 
+# Compiling and publishing a word type's patterns is done by one thread at a time, "ad_" is the combined ad categories
+compile_locks: Dict[str, Lock] = {word_type: Lock() for word_type in list(regex) + ["ad_"]}
+
+regex_chunk: int = 100
+
+regex_corpus: List[str] = [
+    # Typical
+    "Hello everyone, welcome to the group! Please read the pinned message before posting.",
+    "大家好，欢迎加入本群，发言前请先阅读置顶消息。",
+    "Join our channel t.me/example for daily signals, contact @example_bot for more",
+    "加微信 abc12345 领取免费福利，QQ 123456789，电话 +86 138 0013 8000",
+    "https://example.com/path/to/page?query=1&next=2 #tag 😀😀😀",
+    # Adversarial
+    "a" * 5000 + "!",
+    "1" * 5000 + "x",
+    " " * 5000 + "x",
+    "ab " * 2000,
+    "加" * 3000 + "!",
+    "http://" + "a." * 2000,
+    "\n".join(["line"] * 1000),
+    "@" + "_" * 3000 + "!"
+]
+
+regex_offences: int = 2
+
+regex_repeat: int = 3
+
+save_dirty: Dict[str, float] = {}
+# save_dirty = {
+#     "configs": 12345.678
+# }
+
+save_event: Event = Event()
+
+save_started: bool = False
+
+save_window: float = 1.0
+
+saves_count: Dict[str, Union[int, float]] = {
+    "request": 0,
+    "record": 0,
+    "flush": 0,
+    "write": 0,
+    "backlog": 0,
+    "latency": 0.0,
+    "latency_max": 0.0
+}
+
 sender: str = "CLEAN"
 
+shard_files: List[str] = ["configs", "message_ids"]
+
 should_hide: bool = False
 
+slow: Deque[Tuple[str, Tuple[str, ...], str, float]] = deque(maxlen=100)
+# slow = deque([("type", ("regex",), "text", 0.5)])
+
+store_db: Optional[Connection] = None
+
+store_files: List[str] = ["bad_ids", "user_ids", "watch_ids"] if store == "sqlite" else []
+
+store_limit: int = 10000
+
+store_path: str = "data/store.db"
+
+store_tables: Dict[str, str] = {
+    "detected": "detections",
+    "join": "joins",
+    "score": "scores"
+}
+
 types: Dict[str, Union[List[str], Set[str]]] = {
     "all": ["con", "loc", "vdn", "voi",
             "ast", "aud", "bmd", "doc", "gam", "gif", "via", "vid", "ser", "sti",
@@ -597,6 +851,21 @@ usernames: Dict[str, Dict[str, Union[int, str]]] = {}
 #     }
 # }
 
+verdicts: Dict[Tuple[str, int], Dict[Tuple[str, bool], Union[dict, tuple]]] = OrderedDict()
+# verdicts = OrderedDict({
+#     ("md5", 1): {
+#         ("type", False): ("regex", Match),
+#         ("ad_", False): {"a": "regex"}
+#     }
+# })
+
+verdicts_count: Dict[str, int] = {
+    "hit": 0,
+    "miss": 0
+}
+
+verdicts_limit: int = 1000
+
 version: str = "0.2.7"
 
 # Load data from pickle
@@ -611,6 +880,32 @@ for path in ["data", "tmp"]:
     if not exists(path):
         mkdir(path)
 
+# Load the emoji matcher, it is only rebuilt when the emoji package or the protected emojis change
+try:
+    with open("data/emoji_trie", "rb") as f:
+        emoji_artifact = pickle.load(f)
+
+    if emoji_artifact["version"] == (emoji_version, emoji_protect):
+        emoji_trie = emoji_artifact["trie"]
+except Exception as e:
+    logger.info(f"Load emoji trie error: {e}")
+
+if not emoji_trie:
+    # A protected emoji ends with "", so it is still matched as a whole but not counted
+    for emoji in UNICODE_EMOJI:
+        node = emoji_trie
+
+        for char in emoji:
+            node = node.setdefault(char, {})
+
+        node[""] = "" if emoji in emoji_protect else emoji
+
+    try:
+        with open("data/emoji_trie", "wb") as f:
+            pickle.dump({"version": (emoji_version, emoji_protect), "trie": emoji_trie}, f)
+    except Exception as e:
+        logger.warning(f"Save emoji trie error: {e}", exc_info=True)
+
 # Init ids variables
 
 admin_ids: Dict[int, Set[int]] = {}
@@ -739,9 +1034,18 @@ for word_type in regex:
 
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "except_ids", "left_group_ids", "message_ids", "user_ids", "watch_ids",
-                        "configs"]
+                        "configs", "quarantine"]
 file_list += [f"{f}_words" for f in regex]
+
+# The data kept in the store is not loaded, unless the store is going to be built from it
+if exists(store_path):
+    file_list = [f for f in file_list if f not in store_files]
+
 for file in file_list:
+    # The groups' data is loaded on first use once it is split into files per group
+    if file in shard_files and exists("data/groups"):
+        continue
+
     try:
         try:
             if exists(f"data/{file}") or exists(f"data/.{file}"):
@@ -758,6 +1062,24 @@ for file in file_list:
         logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
+# Replay the changes of users' status journaled after the last snapshot
+if "user_ids" in file_list and exists("data/user_ids.journal"):
+    with open("data/user_ids.journal") as f:
+        for line in f:
+            try:
+                record = loads(line)
+                journal_count += 1
+
+                if record[0] == "clear":
+                    for uid in user_ids:
+                        user_ids[uid][record[1]] = {}
+                elif record[0] == "reset":
+                    user_ids[record[1]] = deepcopy(default_user_status)
+                else:
+                    user_ids.setdefault(record[1], deepcopy(default_user_status))[record[0]][record[2]] = record[3]
+            except Exception as e:
+                logger.warning(f"Replay user journal error: {e}", exc_info=True)
+
 # Generate special characters dictionary
 for special in ["spc", "spe"]:
     locals()[f"{special}_dict"]: Dict[str, str] = {}
@@ -775,6 +1097,12 @@ for special in ["spc", "spe"]:
         for k in keys:
             locals()[f"{special}_dict"][k] = value
 
+# Generate special characters translation table, spc first and then spe
+special_table: Dict[int, str] = str.maketrans({
+    k: locals()["spe_dict"].get(locals()["spc_dict"].get(k, k), locals()["spc_dict"].get(k, k))
+    for k in set(locals()["spc_dict"]) | set(locals()["spe_dict"])
+})
+
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019 SCP-079 <https://scp-079.org>\n"
                   "Licensed under the terms of the GNU General Public License v3 or later (GPLv3+)\n")
@@ -79,7 +79,7 @@ def clean(client: Client, message: Message) -> bool:
             for sticker_mid in mids:
                 glovar.message_ids[gid]["stickers"].pop(sticker_mid, 0)
 
-            save("message_ids")
+            save("message_ids", gid)
 
             # Generate the report message's text
             text = (f"{lang('admin')}{lang('colon')}{code(aid)}\n"
@@ -143,7 +143,7 @@ def config(client: Client, message: Message) -> bool:
 
         # Set lock
         glovar.configs[gid]["lock"] = now
-        save("configs")
+        save("configs", gid)
 
         # Ask CONFIG generate a config session
         group_name, group_link = get_group_info(client, message.chat)
@@ -252,7 +252,8 @@ def config_directly(client: Client, message: Message) -> bool:
         if success and new_config != glovar.configs[gid]:
             # Save new config
             glovar.configs[gid] = new_config
-            save("configs")
+            glovar.plans.pop(gid, None)
+            save("configs", gid)
 
             # Send debug message
             debug_text = get_debug_text(client, message.chat)
@@ -452,7 +453,7 @@ def purge_begin(client: Client, message: Message) -> bool:
         r_mid = r_message.message_id
         now = message.date or get_now()
         glovar.message_ids[gid]["purge"] = (r_mid, now)
-        save("message_ids")
+        save("message_ids", gid)
 
         # Generate the report message's text
         aid = message.from_user.id
@@ -527,7 +528,7 @@ def purge_end(client: Client, message: Message) -> bool:
             glovar.purged_ids.add(gid)
             thread(delete_messages, (client, gid, range(bid, eid + 1)))
             glovar.message_ids[gid]["purge"] = (0, 0)
-            save("message_ids")
+            save("message_ids", gid)
 
             # Generate the report message's text
             aid = message.from_user.id
@@ -576,6 +577,19 @@ def version(client: Client, message: Message) -> bool:
         text = (f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
                 f"{lang('version')}{lang('colon')}{bold(glovar.version)}\n")
 
+        # Status
+        text += (f"{lang('plan_fast')}{lang('colon')}{code(glovar.plan_counts['fast'])}\n"
+                 f"{lang('plan_full')}{lang('colon')}{code(glovar.plan_counts['full'])}\n"
+                 f"{lang('verdicts_hit')}{lang('colon')}{code(glovar.verdicts_count['hit'])}\n"
+                 f"{lang('verdicts_miss')}{lang('colon')}{code(glovar.verdicts_count['miss'])}\n")
+
+        latency = f"{glovar.saves_count['latency']:.3f}s / {glovar.saves_count['latency_max']:.3f}s"
+        text += (f"{lang('saves_request')}{lang('colon')}{code(glovar.saves_count['request'])}\n"
+                 f"{lang('saves_record')}{lang('colon')}{code(glovar.saves_count['record'])}\n"
+                 f"{lang('saves_write')}{lang('colon')}{code(glovar.saves_count['write'])}\n"
+                 f"{lang('saves_backlog')}{lang('colon')}{code(glovar.saves_count['backlog'])}\n"
+                 f"{lang('saves_latency')}{lang('colon')}{code(latency)}\n")
+
         # Send the report message
         thread(send_message, (client, cid, text, mid))
 
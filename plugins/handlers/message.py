@@ -21,14 +21,15 @@ import logging
 from pyrogram import Client, Filters, Message
 
 from .. import glovar
-from ..functions.channel import get_content, get_debug_text
-from ..functions.etc import code, delay, general_link, get_filename, get_forward_name, get_full_name, get_now, get_text
+from ..functions.channel import get_debug_text
+from ..functions.etc import code, delay, general_link, get_full_name, get_now
 from ..functions.etc import lang, mention_id, t2t, thread
-from ..functions.file import save
+from ..functions.features import set_features
+from ..functions.file import save, save_user
 from ..functions.filters import authorized_group, class_d, declared_message, exchange_channel, from_user, hide_channel
-from ..functions.filters import is_ban_text, is_bio_text, is_class_d_user, is_declared_message, is_high_score_user
-from ..functions.filters import is_in_config, is_limited_user, is_nm_text, is_not_allowed, is_regex_text, is_watch_user
-from ..functions.filters import new_group, test_group
+from ..functions.filters import get_plan, is_ban_text, is_bio_text, is_class_d_user, is_declared_message
+from ..functions.filters import is_detected_user, is_high_score_user, is_in_config, is_limited_user, is_nm_text
+from ..functions.filters import is_not_allowed, is_regex_text, is_watch_user, new_group, test_group
 from ..functions.group import delete_message, leave_group
 from ..functions.ids import init_group_id, init_user_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_config_commit, receive_clear_data
@@ -36,6 +37,7 @@ from ..functions.receive import receive_config_reply, receive_config_show, recei
 from ..functions.receive import receive_leave_approve, receive_regex, receive_refresh, receive_remove_bad
 from ..functions.receive import receive_remove_except, receive_remove_score, receive_remove_watch, receive_rollback
 from ..functions.receive import receive_text_data, receive_user_score, receive_watch_user
+from ..functions.regex import finish_context, start_context
 from ..functions.telegram import get_admins, get_user_bio, send_message
 from ..functions.tests import clean_test
 from ..functions.timers import backup_files, send_count
@@ -60,24 +62,28 @@ def check(client: Client, message: Message) -> bool:
         glovar.locks["message"].acquire()
 
     try:
+        # Cache the regex results and the features of the message
+        start_context()
+        features = set_features(message)
+
         # Work with NOSPAM
         gid = message.chat.id
         now = message.date or get_now()
         if glovar.nospam_id in glovar.admin_ids[gid]:
             # Check the forward from name
-            forward_name = get_forward_name(message)
+            forward_name = features.forward_name()
             if forward_name and forward_name not in glovar.except_ids["long"]:
                 if is_nm_text(t2t(forward_name, True, True)):
                     return False
 
             # Check the user's name
-            name = get_full_name(message.from_user)
+            name = features.full_name()
             if name and name not in glovar.except_ids["long"]:
                 if is_nm_text(t2t(name, True, True)):
                     return False
 
             # Check the text
-            message_text = get_text(message, True, True)
+            message_text = features.text(True, True)
             if is_ban_text(message_text, False):
                 return False
 
@@ -85,7 +91,7 @@ def check(client: Client, message: Message) -> bool:
                 return False
 
             # File name
-            filename = get_filename(message, True, True)
+            filename = features.filename(True, True)
             if is_ban_text(filename, False):
                 return False
 
@@ -114,8 +120,15 @@ def check(client: Client, message: Message) -> bool:
         if is_declared_message(None, message):
             return True
 
+        # Skip the filters if none of the group's enabled checks could apply to the message
+        if not features.mask() & get_plan(gid).get("mask", -1) and not is_detected_user(message):
+            glovar.plan_counts["fast"] += 1
+            return True
+
+        glovar.plan_counts["full"] += 1
+
         # Not allowed message
-        content = get_content(message)
+        content = features.content()
         detection = is_not_allowed(client, message)
         if detection:
             result = terminate_user(client, message, detection)
@@ -130,6 +143,8 @@ def check(client: Client, message: Message) -> bool:
     except Exception as e:
         logger.warning(f"Check error: {e}", exc_info=True)
     finally:
+        finish_context()
+
         if has_text:
             glovar.locks["text"].release()
         else:
@@ -180,8 +195,7 @@ def check_join(client: Client, message: Message) -> bool:
                 continue
 
             # Update user's join status
-            glovar.user_ids[uid]["join"][gid] = now
-            save("user_ids")
+            save_user(["join", uid, gid, now])
 
         # Delete service message
         if is_in_config(gid, "ser"):
@@ -189,7 +203,7 @@ def check_join(client: Client, message: Message) -> bool:
                 delay(10, delete_message, [client, gid, glovar.message_ids[gid]["service"]])
 
             glovar.message_ids[gid]["service"] = mid
-            save("message_ids")
+            save("message_ids", gid)
 
         return True
     except Exception as e: